@@ -19,14 +19,24 @@
 
 import logging
 import hashlib
+import threading
 import time
 import urllib
-import json
+import Queue
 
 import requests
 from requests.auth import AuthBase
 
 from config import Config
+from clock import DriftClock, KEEP_TTL
+from session import SessionPool
+from ratelimit import Scheduler, RETRIES, BACKOFF
+from validation import Validators
+from deadline import Deadline, scope as deadline_scope
+import metrics
+import batch
+import codec
+import flight
 from errors import OCAPyException, OCAPyRequestException
 
 # Current logger
@@ -36,6 +46,48 @@ logging.basicConfig(level=logging.INFO)
 logging.getLogger("requests").setLevel(logging.WARNING)
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 
+logger = logging.getLogger()
+
+# OVH error codes of a request refused because of its timestamp
+TIME_ERROR_CODES = ('INVALID_SIGNATURE', 'QUERY_TIME_OUT')
+
+# Maximum number of sub resources kept by each resource, the bound is per
+# resource and not global
+CHILDREN_SIZE = 1024
+
+# Size of the chunks read from a streamed response, in bytes
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# A hedged GET is sent again once it lasts more than this quantile of the
+# latency of its path template, measured on at least HEDGE_MIN_COUNT GETs
+HEDGE_QUANTILE = 0.95
+HEDGE_MIN_COUNT = 20
+
+# Keep resource in the children cache under key. When it is full an
+# arbitrary child is dropped, not the least recently used one, so that a
+# lookup stays a plain dict access; a dropped child is built again when used
+def remember(children, key, resource):
+    if len(children) >= CHILDREN_SIZE:
+        try:
+            children.popitem()
+        except KeyError:
+            pass
+    children[key] = resource
+
+# Run function in a new daemon thread
+def run_in_thread(function):
+    thread = threading.Thread(target=function)
+    thread.daemon = True
+    thread.start()
+
+# Seconds to wait for at most delay seconds, or None (no limit), without
+# going past deadline
+def time_left(deadline, delay=None):
+    if deadline is None:
+        return delay
+    left = max(0, deadline.remaining())
+    return left if delay is None else min(delay, left)
+
 # Authentication class which inherit from requests.auth.AuthBase
 # requests module usage only
 class OVHAuth(AuthBase):
@@ -43,7 +95,8 @@ class OVHAuth(AuthBase):
 
     def __init__(self, consumer_key=None, app_secret=None, app_key=None,
                  base_url=None, time_path='auth/time', url_path='/',
-                 request_type='GET', content=None, params=None):
+                 request_type='GET', content=None, params=None, clock=None,
+                 session=None):
         self.consumer_key = consumer_key
         self.app_key = app_key
         self.app_secret = app_secret
@@ -59,6 +112,15 @@ class OVHAuth(AuthBase):
                               str(self.url_path).lstrip('/'))
         if self.params is not None:
             self.url += '?%s' % self.params
+        self.clock = clock or DriftClock.get(self.base_url,
+                                             time_path=self.time_path)
+        self.session = session
+        # the signature starts with the secret and the consumer key: hash
+        # them once, each signature goes on from a copy of this hash
+        self.prefix = None
+        if self.app_secret is not None and self.consumer_key is not None:
+            self.prefix = hashlib.sha1('%s+%s+' % (self.app_secret,
+                                                   self.consumer_key))
 
     # Compute the request signature
     # Refer to http://www.ovh.com/fr/g934.premiers-pas-avec-l-api 
@@ -66,31 +128,24 @@ class OVHAuth(AuthBase):
         if timestamp is None:
             timestamp = self.now()
 
-        sha1 = hashlib.sha1()
-        content = ''
-        if self.content:
-            content = self.content
-
-        sha1.update('+'.join([self.app_secret,
-                              self.consumer_key,
-                              str(self.request_type).upper(),
-                              self.url,
-                              content,
-                              timestamp]))
+        return self.sign(self.request_type, self.url, self.content, timestamp)
+
+    # Sign a request, url is the full URL, with its query string
+    def sign(self, method, url, content, timestamp):
+        sha1 = self.prefix.copy()
+        sha1.update('+'.join([str(method).upper(), url, content or '',
+                              str(timestamp)]))
         return '$1$'+sha1.hexdigest()
 
     # time is needed to sign the requests
     # Use the URL given by OVH to retrieve time
     def server_time(self):
-        request = requests.get(self.time_url)
-        if request.status_code != requests.codes.ok:
-            raise OCAPyRequestException("Time request error: %s" % request.json()['message'], request=request)
+        return self.clock.server_time(self.session)
 
-        return int(requests.get(self.time_url).text)
-
-    # Return the time difference between OVH and local time
+    # Return the time difference between OVH and local time, the drift is
+    # measured once and cached by the clock shared for the base URL
     def drift_time(self):
-        return self.server_time() - int(time.time())
+        return self.clock.get_drift(self.session)
 
 
     # Return the current time, taking care of drift time
@@ -99,13 +154,24 @@ class OVHAuth(AuthBase):
 
     # Make the class callable
     # rhe r argument is given by requests module
+    # The request is signed as it is sent (r.method, r.url, r.body), so a
+    # single OVHAuth instance signs all the requests of an API
     def __call__(self, r):
 
+        call = metrics.current()
+        if call is not None:
+            started = time.time()
         timestamp = self.now()
+        if call is not None:
+            synced = time.time()
         r.headers['X-Ovh-Consumer'] = self.consumer_key
         r.headers['X-Ovh-Application'] = self.app_key
-        r.headers['X-Ovh-Signature'] = self.signature(timestamp=timestamp)
-        r.headers['X-Ovh-Timestamp'] = str(timestamp)
+        r.headers['X-Ovh-Signature'] = self.sign(r.method, r.url, r.body,
+                                                 timestamp)
+        if call is not None:
+            call.add('sync', synced - started)
+            call.add('sign', time.time() - synced)
+        r.headers['X-Ovh-Timestamp'] = timestamp
         r.headers['Content-Type'] = 'application/json'
 
         return r
@@ -116,36 +182,82 @@ class OVHAuth(AuthBase):
 # 2. path: the full path to access to the resource (ex: https://api.ovh.com/1.0/dedicated/server)
 # 3. api: the api object related to the resource
 # 4. callable: the class to call that permit method chaining ( api.me.ovhAccount('FR').creditOrder )
+# 5. template: the path where the call arguments are replaced by {id}, it
+#    identifies the resource in metrics (ex: /dedicated/server/{id}/ips)
+# Resources are immutable, each one keeps the sub resources already built
+# (children) so walking the same path again allocates nothing
 class Resource(object):
     """"""
 
-    def __init__(self, name=None, path=None, api=None, callable=None):
+    __slots__ = ('children', 'name', 'path', 'api', 'callable', 'template')
+
+    def __init__(self, name=None, path=None, api=None, callable=None,
+                 template=None):
+        self.children = {}
         self.name = name
         self.path = path
         self.api = api
         self.callable = callable
+        self.template = template or path
 
     def __call__(self, *args, **kwargs):
         # /dedicated/server/ns1234.ovh.net => dedicated.server("ns1234.ovh.net')
         if len(args) == 1:
             # quote the arg to handle such data: 'a.b.c.d/32'
-            return getattr(self, urllib.quote_plus(args[0]))
+            # ids may also be numbers (ex: DNS record ids)
+            arg = args[0]
+            if not isinstance(arg, basestring):
+                arg = str(arg)
+            return self._child(urllib.quote_plus(arg), variable=True)
 
         # default call is a get()
         return self.get()
 
     def __getattr__(self, name):
-        logging.debug("getattr called for attribute %s" % name)
-        path = '%s/%s' % (self.path.rstrip('/'), name)
-        return self.callable(name=name,
-                             api=self.api,
-                             path=path,
-                             callable=self.callable)
+        # special attributes are not resources (copy, pickle, ...)
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return self._child(name)
+
+    # Return the sub resource called name, variable is True when name is a
+    # call argument. server('ips') and server.ips have the same path but not
+    # the same template, they are kept apart
+    def _child(self, name, variable=False):
+        key = (name, variable)
+        child = self.children.get(key)
+        if child is None:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("getattr called for attribute %s" % name)
+            path = '%s/%s' % (self.path.rstrip('/'), name)
+            template = '%s/%s' % (self.template.rstrip('/'),
+                                  '{id}' if variable else name)
+            child = self.callable(name=name,
+                                  api=self.api,
+                                  path=path,
+                                  callable=self.callable,
+                                  template=template)
+            remember(self.children, key, child)
+        return child
 
     # The common request method called by get, put, post, delete methods
     # This method return a requests instance or raise an exception if request
     # fail (return code != requests.codes.ok )
+    # The request is reported to the API's instrumentation if any
     def _request(self, type='GET', kwargs=None):
+        instrumentation = self.api.instrumentation
+        if instrumentation is None:
+            return self._perform(type, kwargs)
+
+        call = instrumentation.start(self, type, kwargs.get('params'))
+        try:
+            result = self._perform(type, kwargs, call)
+        except Exception as e:
+            instrumentation.fail(call, e)
+            raise
+        instrumentation.finish(call)
+        return result
+
+    def _perform(self, type='GET', kwargs=None, call=None):
 
         url = '%s/%s' %(self.api.base_url.rstrip('/'), self.path.lstrip('/'))
         # method: get/post/put/delete
@@ -159,39 +271,243 @@ class Resource(object):
         if params is not None:
             full_url += '?%s' % (params)
 
-        logging.debug("%s %s" % (method, full_url ))
-        logging.debug("path is %s" % self.path)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%s %s" % (method, full_url ))
+            logger.debug("path is %s" % self.path)
+
+        # raw=True returns the response body as is, lazy=True returns a
+        # codec.JSONView which decodes it only when used
+        raw = kwargs.pop('raw', False)
+        lazy = kwargs.pop('lazy', False)
+        # stream=True yields the elements of a JSON array as the body is read
+        stream = kwargs.pop('stream', False)
+        # identical GETs in progress share one request, coalesce=False skips it
+        flights = self.api.flights if kwargs.pop('coalesce', True) else None
+        # deadline=seconds bounds the whole call, drift sync and retries
+        # included, hedge=False/True/seconds replaces the API's setting
+        seconds = kwargs.pop('deadline', self.api.deadline)
+        deadline = None
+        if seconds is not None:
+            deadline = Deadline(seconds, what='%s %s' % (method.upper(),
+                                                         full_url))
+        hedge = kwargs.pop('hedge', self.api.hedge)
+
+        # check the request against the schemas, validate=False skips it
+        if kwargs.pop('validate', True) and self.api.validators is not None:
+            self.api.validators.validate(self.path, method,
+                                         params=kwargs.get('params'),
+                                         data=kwargs.get('data'))
+
+        # GET responses may be served by the cache, cache=False skips it
+        cache = self.api.cache if kwargs.pop('cache', True) else None
+        cache_key = None
+        if self.api.cache is not None and method == 'get':
+            cache_key = self.api.cache.key(self.api, method, self.path, params)
+            if cache is not None:
+                cached = cache.get(cache_key)
+                if cached is not None:
+                    logger.debug("%s served by cache", full_url)
+                    if call is not None:
+                        call.cached = True
+                        call.status = requests.codes.ok
+                    if stream:
+                        return codec.iter_array(cached)
+                    return self._decode(cached, call, raw, lazy)
 
         if 'data' in kwargs:
-            kwargs['data'] = json.dumps(kwargs['data'])
+            kwargs['data'] = codec.dumps(kwargs['data'])
         else:
             kwargs['data'] = ''
-
-        # call requests
-        response = getattr(requests, method)(url,
-                                           auth=self.api.auth(
-                                               url_path=self.path,
-                                               consumer_key=self.api.consumer_key,
-                                               app_key=self.api.app_key,
-                                               app_secret=self.api.app_secret,
-                                               base_url=self.api.base_url,
-                                               request_type=method,
-                                               params = params,
-                                               content = kwargs['data'],
-                                           ),
-                                           **kwargs)
+        if stream:
+            kwargs['stream'] = True
+
+        started = time.time()
+        shared = False
+        if flights is not None and method == 'get' and not stream:
+            # a request signed with other credentials, the secret included,
+            # may get another answer
+            flight_key = self.api.identity() + (self.path, params)
+            (response, error), shared = flights.do(
+                flight_key,
+                lambda: self._fetch(method, url, params, kwargs, deadline,
+                                    hedge),
+                timeout=deadline.timeout() if deadline is not None else None)
+            if shared:
+                logger.debug("%s shared with a request in progress", full_url)
+        else:
+            response, error = self._fetch(method, url, params, kwargs,
+                                          deadline, hedge)
+
+        if call is not None:
+            call.coalesced = shared
+            call.status = response.status_code
+            call.add('network', time.time() - started -
+                     call.phases['sync'] - call.phases['sign'])
+
+        # a write drops the cached responses it may have changed, streamed
+        # responses are not kept
+        if self.api.cache is not None:
+            if cache_key is None:
+                self.api.cache.invalidate(self.path)
+            elif response.status_code == requests.codes.ok and not stream \
+                 and not shared:
+                self.api.cache.set(cache_key, self.path, response.content)
 
         # check the response, and raise the exception in case of non ok HTTP code
-        if response.status_code != requests.codes.ok:
+        if error is not None:
             message = "%s %s [%s]: %s" % (str(type).upper(),
                                         response.url,
                                         response.status_code,
-                                        response.json()['message']
+                                        error.get('message')
                                        )
             raise OCAPyRequestException(message, request=response)
                              
+        elif stream:
+            return self._stream(response)
+        else:
+            return self._decode(response.content, call, raw, lazy)
+
+    # Send the request, return the response and its decoded error if any
+    def _fetch(self, method, url, params, kwargs, deadline=None, hedge=False):
+        # call requests, throttled and retried by the API's scheduler
+        send = lambda: self._send(method, url, params, kwargs, deadline)
+        if hedge and method == 'get' and not kwargs.get('stream'):
+            send = lambda: self._hedge(method, url, params, kwargs, deadline,
+                                       hedge)
+        response = self.api.scheduler.run(send, method, deadline)
+        error = self._error(response)
+
+        # the timestamp may have been refused because OVH time drifted since
+        # the last measure: measure it again and retry once
+        if self._is_time_error(response, error):
+            logging.debug("timestamp refused, syncing time again")
+            self.api.clock.invalidate()
+            response = self.api.scheduler.run(send, method, deadline)
+            error = self._error(response)
+        return response, error
+
+    # Decode a response body with the selected JSON library, unless the raw
+    # body or a lazy view of it is wanted
+    def _decode(self, text, call=None, raw=False, lazy=False):
+        if raw:
+            return text
+        if lazy:
+            return codec.JSONView(text)
+        if call is None:
+            return codec.loads(text)
+        started = time.time()
+        value = codec.loads(text)
+        call.add('decode', time.time() - started)
+        return value
+
+    # Yield the elements of the JSON array of a streamed response, chunk by
+    # chunk, so only a chunk and the element being read are held in memory
+    def _stream(self, response):
+        parser = codec.ArrayParser()
+        try:
+            for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+                for element in parser.feed(chunk):
+                    yield element
+            for element in parser.close():
+                yield element
+        finally:
+            response.close()
+
+    # Decode the error of a failed response once, None if the response is ok
+    # The error is a dict, with at least a message
+    def _error(self, response):
+        if response.status_code == requests.codes.ok:
+            return None
+        try:
+            error = codec.loads(response.content)
+        except ValueError:
+            error = None
+        if not isinstance(error, dict):
+            error = {'message': response.content}
+        return error
+
+    # Send the signed request through the API's pooled connections. With a
+    # deadline, the time request and each network operation (connection,
+    # read) are bounded by the time left
+    def _send(self, method, url, params, kwargs, deadline=None):
+        started = time.time()
+        if deadline is None:
+            response = self.api.sessions.request(method, url,
+                                                 auth=self.api.signer,
+                                                 **kwargs)
+        else:
+            kwargs = dict(kwargs, timeout=deadline.timeout())
+            try:
+                with deadline_scope(deadline):
+                    response = self.api.sessions.request(method, url,
+                                                         auth=self.api.signer,
+                                                         **kwargs)
+            except requests.exceptions.RequestException as e:
+                # a read timeout while reading the body is a ConnectionError
+                if isinstance(e, requests.exceptions.Timeout) or \
+                   deadline.expired():
+                    raise deadline.error()
+                raise
+        if method == 'get':
+            self.api.latencies.observe(self.template, time.time() - started)
+        return response
+
+    # Send a GET, and send it a second time if it is not answered after the
+    # hedge delay: the first response received is kept, so a stalled
+    # connection does not stall the call. hedge is the delay in seconds, or
+    # True for the HEDGE_QUANTILE of the latency of the path template
+    def _hedge(self, method, url, params, kwargs, deadline, hedge):
+        if hedge is True:
+            delay = self.api.latencies.quantile(self.template, HEDGE_QUANTILE,
+                                                HEDGE_MIN_COUNT)
         else:
-            return response.json()
+            delay = hedge
+        if delay is None or delay == float('inf'):
+            return self._send(method, url, params, kwargs, deadline)
+
+        answers = Queue.Queue()
+
+        def attempt():
+            try:
+                answers.put((self._send(method, url, params, kwargs,
+                                        deadline), None))
+            except Exception as e:
+                answers.put((None, e))
+
+        run_in_thread(attempt)
+        try:
+            response, error = answers.get(timeout=time_left(deadline, delay))
+        except Queue.Empty:
+            if deadline is not None:
+                deadline.check()
+            logger.debug("%s not answered after %.3fs, sending it again" %
+                         (url, delay))
+            if self.api.scheduler.bucket is not None:
+                self.api.scheduler.bucket.acquire(deadline)
+            run_in_thread(attempt)
+            error = None
+            for pending in range(2):
+                try:
+                    response, failure = answers.get(
+                        timeout=time_left(deadline))
+                except Queue.Empty:
+                    raise deadline.error()
+                if failure is None:
+                    return response
+                error = error or failure
+        if error is not None:
+            raise error
+        return response
+
+    # Tell if the request has been refused because of its timestamp or of
+    # its signature, which is computed with the timestamp
+    def _is_time_error(self, response, error):
+        if response.status_code not in (400, 401, 403) or error is None:
+            return False
+        if error.get('errorCode') in TIME_ERROR_CODES:
+            return True
+        message = (error.get('message') or '').lower()
+        return 'timestamp' in message or 'signature' in message
 
     def get(self, **kwargs):
         logging.debug("GET request")
@@ -209,29 +525,128 @@ class Resource(object):
         logging.debug("DELETE request")
         return self._request(type='DELETE', kwargs=kwargs)
 
+    # GET the sub resource of each id concurrently:
+    # api.dedicated.server.get_many(['ns1.ovh.net', 'ns2.ovh.net']) is
+    # [api.dedicated.server('ns1.ovh.net').get(), ...]
+    # Return a batch.Result per id, in the ids order, a failed request sets
+    # the error of its Result instead of aborting the batch
+    def get_many(self, ids, max_workers=batch.MAX_WORKERS, **kwargs):
+        return batch.fan_out(lambda id: self(id).get(**kwargs), ids,
+                             max_workers=max_workers)
+
+    # Iterate over a list resource: GET the ids list then yield the
+    # (id, detail) couples, in the list order, as soon as they are fetched.
+    # At most window details are fetched ahead, by max_workers threads, so
+    # memory does not depend on the list size. kwargs are given to the list
+    # request. A failed detail request raises its exception.
+    def iter(self, window=batch.WINDOW, max_workers=batch.MAX_WORKERS,
+             **kwargs):
+        ids = self.get(**kwargs)
+        for result in batch.imap(lambda id: self(id).get(), ids,
+                                 max_workers=max_workers, window=window):
+            if not result.ok:
+                raise result.error
+            yield result.key, result.value
+
 
 class API(object):
     """"""
 
+    # class of the resources built by the API
+    resource_class = Resource
+
     def __init__(self, auth=None, base_url=None, app_key=None, app_secret=None,
-                consumer_key=None):
+                consumer_key=None, drift_ttl=KEEP_TTL, sessions=None,
+                pool_connections=10, pool_maxsize=10, max_retries=0,
+                keep_alive=True, cache=None, scheduler=None, rate_limit=None,
+                burst=None, retries=RETRIES, backoff=BACKOFF, validate=None,
+                instrumentation=None, coalesce=True, deadline=None,
+                hedge=False):
+        self.resources = {}
         self.base_url = base_url
         self.auth = auth
         self.app_key = app_key
         self.app_secret = app_secret
         self.consumer_key = consumer_key
-
-    # Dynamic building of resource
+        # the drift between OVH and local time is shared by all the API
+        # instances using the same base URL, only an explicit drift_ttl
+        # changes its ttl
+        self.clock = DriftClock.get(base_url, ttl=drift_ttl)
+        # persistent connections, a SessionPool may be shared between API
+        # instances with the sessions argument
+        self.sessions = sessions or SessionPool(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=max_retries,
+            keep_alive=keep_alive)
+        # optional cache.ResponseCache of the GET responses
+        self.cache = cache
+        # requests rate (per second) is shared by all the API instances
+        # using the same application key
+        self.scheduler = scheduler or Scheduler(rate=rate_limit, burst=burst,
+                                                key=app_key, retries=retries,
+                                                backoff=backoff)
+        # requests are checked against the schemas of the validate
+        # SchemaStore before being sent
+        self.validators = None
+        if validate is not None:
+            self.validators = Validators(validate)
+        # optional metrics.Instrumentation called around the requests
+        self.instrumentation = instrumentation
+        # identical GETs made at the same time by several threads share one
+        # request, whatever the OCAPy instance they are made with
+        self.flights = flight.shared if coalesce else None
+        # seconds a call may last, drift sync and retries included, None for
+        # no limit
+        self.deadline = deadline
+        # a GET not answered after hedge seconds (or after the 95th
+        # percentile of the latency of its path template when hedge is True)
+        # is sent a second time and the first response is kept
+        self.hedge = hedge
+        self.latencies = metrics.Latencies()
+        # a single signer signs all the requests
+        self.signer = None
+        if self.auth is not None:
+            self.signer = self.auth(consumer_key=consumer_key,
+                                    app_key=app_key,
+                                    app_secret=app_secret,
+                                    base_url=base_url,
+                                    clock=self.clock,
+                                    session=self.sessions)
+
+    # The base URL and credentials the answers depend on, the secret as a
+    # digest so the identity may be stored
+    def identity(self):
+        return (self.base_url, self.app_key,
+                hashlib.sha1(self.app_secret or '').hexdigest(),
+                self.consumer_key)
+
+    # Return a batch.Batch to queue writes and run them concurrently:
+    # with ocapy.batch(max_workers=20) as writes:
+    #     writes.put(ocapy.domain.zone(zone).record(id), data=record)
+    # print writes.report.failed
+    def batch(self, max_workers=batch.MAX_WORKERS):
+        return batch.Batch(max_workers=max_workers)
+
+    # Dynamic building of resource, the resources are built once
     def __getattr__(self, attribute):
-        path='/%s' % attribute
-        return Resource(name=attribute, api=self, path=path, callable=Resource)
+        if attribute.startswith('__') or attribute == 'resources':
+            raise AttributeError(attribute)
+        resource = self.resources.get(attribute)
+        if resource is None:
+            path='/%s' % attribute
+            resource = self.resource_class(name=attribute, api=self, path=path,
+                                           callable=self.resource_class)
+            remember(self.resources, attribute, resource)
+        return resource
 
 
 class OCAPy(API):
     """"""
     def __init__(self, ocapy_profile=None, **kwargs):
         if ocapy_profile is not None:
-            config=Config()
+            # the configuration file is parsed once, until it is modified
+            config=Config.cached()
             if ocapy_profile == 'default':
                 profile = config.profile(config.ocapy.profile)
             else:
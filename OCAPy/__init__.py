@@ -5,7 +5,65 @@ __author__ = 'Pierre-Samuel Le Stang'
 __email__ = 'ps@lestang.fr'
 __version__ = '0.2.1'
 
-from OCAPy import OCAPy
-from schema import Schemas, Schema
-from config import Config
-from input import UserInput, color
+import sys
+from types import ModuleType
+
+# Public names and the modules defining them. The modules are imported when
+# a name is first used, so importing OCAPy or one of its light modules
+# (config, input) does not import requests.
+EXPORTS = {
+    'OCAPy': 'OCAPy',
+    'AsyncOCAPy': 'aio',
+    'Batch': 'batch',
+    'Sweep': 'sweep',
+    'Mirror': 'mirror',
+    'Crawler': 'crawl',
+    'Cassette': 'cassette',
+    'Schemas': 'schema',
+    'Schema': 'schema',
+    'SchemaStore': 'schema',
+    'Config': 'config',
+    'ResponseCache': 'cache',
+    'MemoryBackend': 'cache',
+    'SqliteBackend': 'cache',
+    'Instrumentation': 'metrics',
+    'Metrics': 'metrics',
+    'JsonLines': 'metrics',
+    'UserInput': 'input',
+    'color': 'input',
+}
+
+__all__ = sorted(EXPORTS)
+
+
+class Package(ModuleType):
+    """The OCAPy package, its public names are imported on first use"""
+
+    def __getattr__(self, name):
+        module = EXPORTS.get(name)
+        if module is None:
+            raise AttributeError(name)
+        value = getattr(__import__('%s.%s' % (__name__, module), None, None,
+                                   [name]), name)
+        setattr(self, name, value)
+        return value
+
+    # Importing the OCAPy.OCAPy module sets the OCAPy attribute of the package
+    # to the module, the OCAPy name is the class
+    def __getattribute__(self, name):
+        value = ModuleType.__getattribute__(self, name)
+        if name == 'OCAPy' and isinstance(value, ModuleType):
+            value = value.OCAPy
+            setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(EXPORTS))
+
+
+package = Package(__name__, __doc__)
+package.__dict__.update(dict((key, value) for key, value in globals().items()
+                             if key not in ('sys', 'ModuleType', 'package')))
+# the globals of a module are cleared when it is released, keep it
+package._module = sys.modules[__name__]
+sys.modules[__name__] = package
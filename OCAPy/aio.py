@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Pierre-Samuel Le Stang (ps@lestang.fr)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. module:: aio
+    :platform: Unix
+    :synopsis: Non blocking OCAPy client
+
+.. moduleauthor:: Pierre-Samuel Le Stang <ps@lestang.fr>
+
+The requests of an :class:`AsyncOCAPy` return immediately a :class:`Future`
+and are run on a pool of at most `concurrency` workers, whatever the number
+of pending requests is::
+
+    api = AsyncOCAPy(ocapy_profile='default', concurrency=20)
+    future = api.me.ovhAccount('FR').get()
+    future.add_done_callback(lambda f: handle(f.result()))
+    # or wait for it
+    account = future.result(timeout=10)
+
+"""
+
+import logging
+import threading
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+from OCAPy import OCAPy, Resource
+from batch import Result, WINDOW
+from errors import OCAPyException, OCAPyCancelledException
+
+# Default number of requests run at the same time
+CONCURRENCY = 10
+
+class Future(object):
+    """The pending result of a request, it follows the
+    concurrent.futures.Future interface"""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._running = False
+        self._cancelled = False
+        self._value = None
+        self._error = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done.is_set()
+
+    def running(self):
+        return self._running and not self.done()
+
+    def cancelled(self):
+        return self._cancelled
+
+    # A request not started yet is not sent, its result raises
+    # OCAPyCancelledException. Return False if it is running or done: a
+    # running request is bounded by its deadline
+    def cancel(self):
+        with self._lock:
+            if self._running or self.done():
+                return False
+            self._cancelled = True
+        self._set(error=OCAPyCancelledException('Request cancelled'))
+        return True
+
+    # Mark the future as running, return False if it was cancelled
+    def _start(self):
+        with self._lock:
+            if self._cancelled:
+                return False
+            self._running = True
+            return True
+
+    def result(self, timeout=None):
+        self._wait(timeout)
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+    def exception(self, timeout=None):
+        self._wait(timeout)
+        return self._error
+
+    # fn is called with the future as soon as it is done, immediately if it
+    # is already done
+    def add_done_callback(self, fn):
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(fn)
+                return
+        self._call(fn)
+
+    def _wait(self, timeout):
+        if not self._done.wait(timeout):
+            raise OCAPyException('Request not done after %ss' % timeout)
+
+    def _set(self, value=None, error=None):
+        with self._lock:
+            self._value = value
+            self._error = error
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            self._call(fn)
+
+    # A failing callback is logged, it does not change the result
+    def _call(self, fn):
+        try:
+            fn(self)
+        except Exception:
+            logging.exception('Future callback %r failed' % fn)
+
+# Return a Future of the batch.Result list of futures, keys are used as
+# Result keys
+def gather(futures, keys=None):
+    futures = list(futures)
+    keys = list(keys) if keys is not None else range(len(futures))
+    gathered = Future()
+    results = [None] * len(futures)
+    pending = [len(futures)]
+    lock = threading.Lock()
+
+    if not futures:
+        gathered._set(value=[])
+        return gathered
+
+    def done(index):
+        def callback(future):
+            error = future.exception()
+            results[index] = Result(key=keys[index],
+                                    value=None if error else future.result(),
+                                    error=error)
+            with lock:
+                pending[0] -= 1
+                finished = pending[0] == 0
+            if finished:
+                gathered._set(value=results)
+        return callback
+
+    for index, future in enumerate(futures):
+        future.add_done_callback(done(index))
+    return gathered
+
+
+class AsyncResource(Resource):
+    """Resource whose requests return a Future"""
+
+    __slots__ = ()
+
+    # Run the request on the API's workers
+    def _request(self, type='GET', kwargs=None):
+        return self.api.submit(super(AsyncResource, self)._request,
+                               type=type, kwargs=kwargs)
+
+    # Return a Future of the batch.Result list, max_workers is ignored: the
+    # concurrency is the API's one
+    def get_many(self, ids, max_workers=None, **kwargs):
+        ids = list(ids)
+        return gather([self(id).get(**kwargs) for id in ids], keys=ids)
+
+    # Iterate over a list resource: wait for the ids list, then yield the
+    # (id, Future) couples in the list order. At most window details are
+    # submitted ahead of the consumer, the API's workers fetch them.
+    # max_workers is ignored, the concurrency is the API's one
+    def iter(self, window=WINDOW, max_workers=None, **kwargs):
+        ids = self.get(**kwargs).result()
+        pending = deque()
+        for id in ids:
+            pending.append((id, self(id).get()))
+            if len(pending) >= max(1, window):
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+
+
+class AsyncOCAPy(OCAPy):
+    """OCAPy client whose requests do not block
+
+    Path building, signing, drift and connections are the ones of
+    :class:`OCAPy`, concurrency is the maximum number of requests run at the
+    same time.
+    """
+
+    resource_class = AsyncResource
+
+    def __init__(self, ocapy_profile=None, concurrency=CONCURRENCY, **kwargs):
+        kwargs.setdefault('pool_maxsize', concurrency)
+        super(AsyncOCAPy, self).__init__(ocapy_profile=ocapy_profile, **kwargs)
+        self.concurrency = concurrency
+        self.workers = ThreadPool(processes=concurrency)
+
+    # Run function(*args, **kwargs) on a worker and return its Future
+    def submit(self, function, *args, **kwargs):
+        future = Future()
+
+        def run():
+            if not future._start():
+                return
+            try:
+                future._set(value=function(*args, **kwargs))
+            except Exception as e:
+                future._set(error=e)
+
+        self.workers.apply_async(run)
+        return future
+
+    # Wait for the pending requests and stop the workers
+    def close(self):
+        self.workers.close()
+        self.workers.join()
+        self.sessions.close()
+
+# vim:set shiftwidth=4 tabstop=4 softtabstop=4 encoding=utf-8 expandtab textwidth=79
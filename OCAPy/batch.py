@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Pierre-Samuel Le Stang (ps@lestang.fr)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import Queue
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+from errors import OCAPyException
+
+# Default number of concurrent requests, it should not exceed the API's
+# pool_maxsize or connections will not be re-used
+MAX_WORKERS = 10
+# Default number of items fetched ahead when iterating
+WINDOW = 20
+
+class Result(object):
+    """The outcome of one request of a batch
+
+    key is the item the request was made for, value the decoded response and
+    error the exception raised by the request if any.
+    """
+
+    def __init__(self, key=None, value=None, error=None):
+        self.key = key
+        self.value = value
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.ok:
+            return '<Result %s: %r>' % (self.key, self.value)
+        return '<Result %s: error %s>' % (self.key, self.error)
+
+# Call function for each item and return a Result per item. The exception
+# raised by a call is stored in its Result and does not stop the others.
+class _Call(object):
+
+    def __init__(self, function):
+        self.function = function
+
+    def __call__(self, item):
+        try:
+            return Result(key=item, value=self.function(item))
+        except Exception as e:
+            return Result(key=item, error=e)
+
+# Run function on each item using at most max_workers threads, results are
+# yielded in the order of items. When window is set, at most window items
+# are fetched ahead of the consumer, so items may be a lazy iterator of any
+# size
+def imap(function, items, max_workers=MAX_WORKERS, window=None):
+    if window is None:
+        items = list(items)
+        if not items:
+            return
+        window = len(items)
+    window = max(1, window)
+    pool = ThreadPool(processes=max(1, min(max_workers, window)))
+    call = _Call(function)
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(pool.apply_async(call, (item,)))
+            if len(pending) >= window:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+
+# Same as imap but results are yielded as soon as they are done, whatever
+# the order of items
+def as_completed(function, items, max_workers=MAX_WORKERS):
+    items = list(items)
+    if not items:
+        return
+    pool = ThreadPool(processes=max(1, min(max_workers, len(items))))
+    try:
+        for result in pool.imap_unordered(_Call(function), items):
+            yield result
+    finally:
+        pool.terminate()
+
+# Same as imap but return the list of results
+def fan_out(function, items, max_workers=MAX_WORKERS):
+    return list(imap(function, items, max_workers=max_workers))
+
+class Operation(object):
+    """A write queued in a Batch: the method of resource called with kwargs"""
+
+    def __init__(self, resource, method, kwargs, phase=0):
+        self.resource = resource
+        self.method = str(method).upper()
+        self.kwargs = kwargs
+        self.phase = phase
+
+    @property
+    def path(self):
+        return self.resource.path
+
+    # Send the request, return the decoded response
+    def run(self):
+        value = getattr(self.resource, self.method.lower())(**self.kwargs)
+        # the requests of an AsyncResource return a Future
+        if hasattr(value, 'add_done_callback'):
+            value = value.result()
+        return value
+
+    def __repr__(self):
+        return '%s %s' % (self.method, self.path)
+
+
+class Batch(object):
+    """Writes queued then run concurrently by at most max_workers threads
+
+    Used as a context manager, the writes are run when the block exits
+    without error. The writes on a path, on its sub paths and on its parent
+    paths are run in the order they were queued, barrier() makes the next
+    writes wait for all the previous ones. A write is not run when a write
+    it waits for failed.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        self.max_workers = max_workers
+        self.operations = []
+        self.phase = 0
+        self.report = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.run()
+        return False
+
+    def __len__(self):
+        return len(self.operations)
+
+    def put(self, resource, **kwargs):
+        return self.add(resource, 'PUT', kwargs)
+
+    def post(self, resource, **kwargs):
+        return self.add(resource, 'POST', kwargs)
+
+    def delete(self, resource, **kwargs):
+        return self.add(resource, 'DELETE', kwargs)
+
+    # Queue a request, return its Operation
+    def add(self, resource, method, kwargs):
+        operation = Operation(resource, method, kwargs, phase=self.phase)
+        self.operations.append(operation)
+        return operation
+
+    # The writes queued from now on wait for the ones already queued
+    def barrier(self):
+        if self.operations and self.operations[-1].phase == self.phase:
+            self.phase += 1
+
+    # Run the queued writes, return and keep their Report
+    def run(self):
+        operations, self.operations = self.operations, []
+        results = _run(operations, _waits(operations), self.max_workers)
+        self.report = Report(results, self.max_workers)
+        return self.report
+
+
+class Report(object):
+    """The Results of a Batch, in the order the writes were queued, the key
+    of a Result is its Operation"""
+
+    def __init__(self, results, max_workers=MAX_WORKERS):
+        self.results = results
+        self.max_workers = max_workers
+
+    @property
+    def succeeded(self):
+        return [result for result in self.results if result.ok]
+
+    @property
+    def failed(self):
+        return [result for result in self.results if not result.ok]
+
+    @property
+    def ok(self):
+        return not self.failed
+
+    # Run the failed writes again, in the same order, return their Report
+    def retry(self, max_workers=None):
+        batch = Batch(max_workers=max_workers or self.max_workers)
+        phase = None
+        for result in self.failed:
+            operation = result.key
+            if phase is not None and operation.phase != phase:
+                batch.barrier()
+            phase = operation.phase
+            batch.add(operation.resource, operation.method, operation.kwargs)
+        return batch.run()
+
+    def __repr__(self):
+        return '<Report: %d succeeded, %d failed>' % (len(self.succeeded),
+                                                      len(self.failed))
+
+# Return the parent paths of path: /a/b/c => /a/b, /a
+def _parents(path):
+    parents = []
+    while True:
+        path = path.rsplit('/', 1)[0]
+        if not path:
+            return parents
+        parents.append(path)
+
+# Return, for each operation, the indexes of the operations it waits for:
+# the last previous one of each overlapping path and all the operations of
+# the previous phases
+def _waits(operations):
+    waits = []
+    last = {}
+    below = {}
+    phase = []
+    previous = []
+    for index, operation in enumerate(operations):
+        if index and operation.phase != operations[index - 1].phase:
+            previous, phase = phase, []
+            last = {}
+            below = {}
+        path = operation.path.rstrip('/')
+        parents = _parents(path)
+        waited = set(previous)
+        for overlapping in [path] + parents + list(below.get(path, ())):
+            if overlapping in last:
+                waited.add(last[overlapping])
+        waits.append(waited)
+        last[path] = index
+        for parent in parents:
+            below.setdefault(parent, set()).add(path)
+        phase.append(index)
+    return waits
+
+# Run the operations, each one once the ones it waits for succeeded, return
+# their Results
+def _run(operations, waits, max_workers):
+    results = [None] * len(operations)
+    if not operations:
+        return results
+    remaining = [len(waited) for waited in waits]
+    waiting = [[] for operation in operations]
+    for index, waited in enumerate(waits):
+        for other in waited:
+            waiting[other].append(index)
+
+    done = Queue.Queue()
+    pool = ThreadPool(processes=max(1, min(max_workers, len(operations))))
+    call = _Call(lambda operation: operation.run())
+
+    def submit(index):
+        pool.apply_async(call, (operations[index],),
+                         callback=lambda result: done.put((index, result)))
+
+    # the operations waiting for a failed one are not run
+    def skip(index, failed):
+        stack = list(waiting[index])
+        while stack:
+            other = stack.pop()
+            if results[other] is None:
+                error = OCAPyException('%r not run: %r failed' %
+                                       (operations[other], failed))
+                results[other] = Result(key=operations[other], error=error)
+                stack.extend(waiting[other])
+
+    running = 0
+    try:
+        for index in range(len(operations)):
+            if not remaining[index]:
+                submit(index)
+                running += 1
+        while running:
+            index, result = done.get()
+            running -= 1
+            results[index] = result
+            if not result.ok:
+                skip(index, operations[index])
+                continue
+            for other in waiting[index]:
+                remaining[other] -= 1
+                if not remaining[other] and results[other] is None:
+                    submit(other)
+                    running += 1
+    finally:
+        pool.terminate()
+    return results
+
+# vim:set shiftwidth=4 tabstop=4 softtabstop=4 encoding=utf-8 expandtab textwidth=79
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Pierre-Samuel Le Stang (ps@lestang.fr)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. module:: cache
+    :platform: Unix
+    :synopsis: Cache of the GET responses
+
+.. moduleauthor:: Pierre-Samuel Le Stang <ps@lestang.fr>
+
+A :class:`ResponseCache` given to OCAPy keeps the GET responses for a ttl
+which depends on the path of the request. Any PUT, POST or DELETE request
+on a path drops the cached responses under this path::
+
+    cache = ResponseCache(ttl=60, ttls={'/me': 600, '/ip': 0},
+                          backend=SqliteBackend('/tmp/ocapy.cache'))
+    ocapy = OCAPy(ocapy_profile='default', cache=cache)
+
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Default cached responses ttl (in seconds) and cache size
+CACHE_TTL = 60
+CACHE_SIZE = 1024
+
+# Return True if path is prefix or is under prefix
+def under(path, prefix):
+    prefix = prefix.rstrip('/')
+    return path == prefix or path.startswith(prefix + '/') or prefix == ''
+
+
+class MemoryBackend(object):
+    """Least recently used responses kept in memory"""
+
+    def __init__(self, max_size=CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    # Return the (value, expires) couple of key or None
+    def get(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        self.entries[key] = entry
+        return entry[1], entry[2]
+
+    def set(self, key, path, value, expires):
+        self.entries.pop(key, None)
+        self.entries[key] = (path, value, expires)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def delete(self, key):
+        self.entries.pop(key, None)
+
+    # Delete the entries of path and of its sub paths
+    def invalidate(self, path):
+        for key, entry in self.entries.items():
+            if under(entry[0], path):
+                del self.entries[key]
+
+    # Delete the entries of path only
+    def delete_path(self, path):
+        for key, entry in self.entries.items():
+            if entry[0] == path:
+                del self.entries[key]
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SqliteBackend(object):
+    """Least recently used responses kept in a sqlite database, the cache
+    survives the process and may be shared by several processes"""
+
+    def __init__(self, filename=None, max_size=CACHE_SIZE):
+        self.filename = filename or '%s/.ocapy.cache' % os.path.expanduser('~')
+        self.max_size = max_size
+        self.db = sqlite3.connect(self.filename, check_same_thread=False,
+                                  isolation_level=None)
+        self.db.execute('CREATE TABLE IF NOT EXISTS response (key TEXT '
+                        'PRIMARY KEY, path TEXT, value BLOB, expires REAL, '
+                        'used REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS response_path ON '
+                        'response (path)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS response_used ON '
+                        'response (used)')
+
+    def get(self, key):
+        row = self.db.execute('SELECT value, expires FROM response WHERE '
+                              'key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        self.db.execute('UPDATE response SET used = ? WHERE key = ?',
+                        (time.time(), key))
+        # bodies are bytes, they are returned as str like by MemoryBackend
+        return str(row[0]), row[1]
+
+    def set(self, key, path, value, expires):
+        self.db.execute('INSERT OR REPLACE INTO response VALUES (?, ?, ?, ?, '
+                        '?)', (key, path, sqlite3.Binary(value), expires,
+                               time.time()))
+        excess = len(self) - self.max_size
+        if excess > 0:
+            self.db.execute('DELETE FROM response WHERE key IN (SELECT key '
+                            'FROM response ORDER BY used LIMIT ?)', (excess,))
+
+    def delete(self, key):
+        self.db.execute('DELETE FROM response WHERE key = ?', (key,))
+
+    def invalidate(self, path):
+        path = path.rstrip('/')
+        if path == '':
+            return self.clear()
+        pattern = path.replace('\\', '\\\\').replace('%', '\\%')\
+                      .replace('_', '\\_')
+        self.db.execute("DELETE FROM response WHERE path = ? OR path LIKE ? "
+                        "ESCAPE '\\'", (path, pattern + '/%'))
+
+    def delete_path(self, path):
+        self.db.execute('DELETE FROM response WHERE path = ?', (path,))
+
+    def clear(self):
+        self.db.execute('DELETE FROM response')
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM response').fetchone()[0]
+
+
+class ResponseCache(object):
+    """Cache of the GET responses
+
+    ttl is the default number of seconds a response is kept, ttls maps path
+    prefixes to their own ttl (the longest matching prefix wins), a ttl of 0
+    disables the cache for the path. The responses are stored in backend,
+    a MemoryBackend by default.
+    """
+
+    def __init__(self, ttl=CACHE_TTL, ttls=None, backend=None,
+                 max_size=CACHE_SIZE):
+        self.ttl = ttl
+        self.ttls = sorted((ttls or {}).items(), key=lambda t: -len(t[0]))
+        # an empty backend is false, it has a length
+        self.backend = backend if backend is not None else \
+                       MemoryBackend(max_size=max_size)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # Return the ttl of path
+    def ttl_for(self, path):
+        for prefix, ttl in self.ttls:
+            if under(path, prefix):
+                return ttl
+        return self.ttl
+
+    # Responses are cached per endpoint and profile, like the coalesced
+    # GETs: the same path may give different answers to different accounts,
+    # and a sqlite cache is shared by all the profiles
+    def key(self, api, method, path, params=None):
+        return '%s %s %s?%s' % (':'.join(str(part) for part in api.identity()),
+                                str(method).upper(), path, params or '')
+
+    # Return the cached raw response of key or None
+    def get(self, key):
+        with self.lock:
+            entry = self.backend.get(key)
+            if entry is not None and entry[1] <= time.time():
+                self.backend.delete(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, path, value):
+        ttl = self.ttl_for(path)
+        if not ttl:
+            return
+        with self.lock:
+            self.backend.set(key, path, value, time.time() + ttl)
+
+    # Drop the responses of path, of its sub paths and of its parent which
+    # lists it
+    def invalidate(self, path):
+        with self.lock:
+            self.backend.invalidate(path)
+            parent = path.rstrip('/').rsplit('/', 1)[0]
+            if parent:
+                self.backend.delete_path(parent)
+
+    def clear(self):
+        with self.lock:
+            self.backend.clear()
+
+    def __len__(self):
+        return len(self.backend)
+
+# vim:set shiftwidth=4 tabstop=4 softtabstop=4 encoding=utf-8 expandtab textwidth=79
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Pierre-Samuel Le Stang (ps@lestang.fr)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. module:: cassette
+    :platform: Unix
+    :synopsis: Record and replay of the HTTP exchanges
+
+.. moduleauthor:: Pierre-Samuel Le Stang <ps@lestang.fr>
+
+A :class:`Cassette` records the responses received by an OCAPy instance,
+the time requests included, and plays them back later without any network
+access. The recording and the replaying are done by requests transport
+adapters plugged in the :class:`SessionPool` of the instance::
+
+    cassette = Cassette('/tmp/servers.cassette')
+    ocapy = OCAPy(sessions=cassette.recorder())
+    servers = dict(ocapy.dedicated.server.iter())
+    cassette.save()
+
+    # no network, responses are returned as fast as possible, or with the
+    # recorded latencies when latency=1
+    ocapy = OCAPy(sessions=Cassette('/tmp/servers.cassette').player())
+
+"""
+
+import base64
+import gzip
+import json
+import os
+import threading
+import time
+import urlparse
+from contextlib import closing
+from datetime import timedelta
+from io import BytesIO
+
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from errors import OCAPyCassetteException
+from session import SessionPool
+
+# Response headers kept by the recording
+HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Retry-After')
+# Path of the OVH time requests
+TIME_PATH = '/auth/time'
+
+
+class Cassette(object):
+    """Recorded HTTP exchanges, saved to a gzipped JSON lines file
+
+    The exchanges are indexed by method, path, sorted query parameters and
+    body. The requests headers are not part of the index, so the
+    signatures and timestamps of OVHAuth, which change at each request, do
+    not prevent a replay from matching. An exchange recorded several times
+    is replayed in the recorded order, the last response is then repeated.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.exchanges = {}
+        # number of times each exchange was replayed
+        self.played = {}
+        self.lock = threading.Lock()
+        if filename is not None:
+            self.load()
+
+    def __len__(self):
+        return sum(len(responses) for responses in self.exchanges.values())
+
+    # Index of a request, JSON bodies are compared whatever the library
+    # which encoded them
+    def key(self, request):
+        url = urlparse.urlsplit(request.url)
+        query = tuple(sorted(urlparse.parse_qsl(url.query,
+                                                keep_blank_values=True)))
+        body = request.body or ''
+        try:
+            body = json.dumps(json.loads(body), sort_keys=True,
+                              separators=(',', ':'))
+        except ValueError:
+            pass
+        return (str(request.method).upper(), url.path, query, body)
+
+    def add(self, request, response, elapsed):
+        content = response.content or ''
+        try:
+            body, encoding = content.decode('utf-8'), None
+        except UnicodeDecodeError:
+            body, encoding = base64.b64encode(content), 'base64'
+        recorded = {'status': response.status_code,
+                    'reason': response.reason,
+                    'headers': dict((name, response.headers[name])
+                                    for name in HEADERS
+                                    if name in response.headers),
+                    'content': body, 'encoding': encoding,
+                    'elapsed': elapsed}
+        with self.lock:
+            self.exchanges.setdefault(self.key(request), []).append(recorded)
+
+    # Return the recorded response to request, None if there is none
+    def play(self, request):
+        key = self.key(request)
+        with self.lock:
+            responses = self.exchanges.get(key)
+            if not responses:
+                return None
+            index = self.played.get(key, 0)
+            self.played[key] = index + 1
+        return responses[min(index, len(responses) - 1)]
+
+    # Replay from the first recorded responses again
+    def rewind(self):
+        with self.lock:
+            self.played = {}
+
+    def load(self):
+        try:
+            f = gzip.open(self.filename, 'rb')
+            with closing(f):
+                lines = f.readlines()
+        except IOError:
+            return False
+        exchanges = {}
+        for line in lines:
+            exchange = json.loads(line)
+            key = (exchange['method'], exchange['path'],
+                   tuple(tuple(item) for item in exchange['query']),
+                   exchange['body'])
+            exchanges.setdefault(key, []).extend(exchange['responses'])
+        with self.lock:
+            self.exchanges = exchanges
+            self.played = {}
+        return True
+
+    # The file is written then renamed so a reader never sees a partial file
+    def save(self, filename=None):
+        filename = filename or self.filename
+        with self.lock:
+            exchanges = sorted(self.exchanges.items())
+        tmp = '%s.tmp' % filename
+        with closing(gzip.open(tmp, 'wb')) as f:
+            for (method, path, query, body), responses in exchanges:
+                f.write(json.dumps({'method': method, 'path': path,
+                                    'query': query, 'body': body,
+                                    'responses': responses},
+                                   separators=(',', ':')) + '\n')
+        os.rename(tmp, filename)
+
+    # Return a SessionPool sending the requests and recording the responses,
+    # kwargs are given to its HTTPAdapter. Closing the pool saves the
+    # cassette.
+    def recorder(self, **kwargs):
+        return SessionPool(adapter=RecordAdapter(self, **kwargs))
+
+    # Return a SessionPool answering the requests with the recorded
+    # responses, latency is the factor applied to the recorded durations (0
+    # to answer at once, 1 for the recorded durations)
+    def player(self, latency=0):
+        return SessionPool(adapter=ReplayAdapter(self, latency=latency))
+
+
+class RecordAdapter(HTTPAdapter):
+    """Sends the requests and records their responses to a cassette"""
+
+    def __init__(self, cassette, **kwargs):
+        HTTPAdapter.__init__(self, **kwargs)
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        started = time.time()
+        response = HTTPAdapter.send(self, request, **kwargs)
+        # a streamed response is read at once to be recorded
+        response.content
+        self.cassette.add(request, response, time.time() - started)
+        return response
+
+    def close(self):
+        HTTPAdapter.close(self)
+        if self.cassette.filename is not None:
+            self.cassette.save()
+
+
+class ReplayAdapter(BaseAdapter):
+    """Answers the requests with the responses recorded in a cassette"""
+
+    def __init__(self, cassette, latency=0):
+        BaseAdapter.__init__(self)
+        self.cassette = cassette
+        self.latency = latency
+
+    def send(self, request, **kwargs):
+        recorded = self.cassette.play(request)
+        # the time may have been synced before the recording started, the
+        # local time is then returned: the replayed requests are not checked
+        if recorded is None and request.method == 'GET' and \
+           urlparse.urlsplit(request.url).path.endswith(TIME_PATH):
+            recorded = {'status': 200, 'reason': 'OK', 'headers': {},
+                        'content': unicode(int(time.time())),
+                        'encoding': None, 'elapsed': 0}
+        if recorded is None:
+            raise OCAPyCassetteException('No recorded response to %s %s' %
+                                         (request.method, request.url))
+        if self.latency:
+            time.sleep(recorded['elapsed'] * self.latency)
+
+        content = recorded['content']
+        if recorded['encoding'] == 'base64':
+            content = base64.b64decode(content)
+        else:
+            content = content.encode('utf-8')
+        response = Response()
+        response.status_code = recorded['status']
+        response.reason = recorded['reason']
+        response.headers = CaseInsensitiveDict(recorded['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = BytesIO(content)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.elapsed = timedelta(seconds=recorded['elapsed'])
+        return response
+
+    def close(self):
+        pass
+
+# vim:set shiftwidth=4 tabstop=4 softtabstop=4 encoding=utf-8 expandtab textwidth=79
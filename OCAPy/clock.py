@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Pierre-Samuel Le Stang (ps@lestang.fr)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+
+import requests
+
+import deadline
+from errors import OCAPyRequestException
+
+# Default number of seconds a measured drift is trusted
+DRIFT_TTL = 300
+# ttl given to DriftClock.get to keep the ttl of the shared clock
+KEEP_TTL = object()
+
+class DriftClock(object):
+    """Estimates and caches the drift between OVH's time and local time
+
+    A clock is shared by every OCAPy instance using the same base URL, the
+    drift is measured once and then re-used until its ttl expires or until
+    it is explicitly invalidated (ex: after a timestamp/signature error).
+    A ttl of None means the drift never expires.
+    """
+
+    # clocks registry: base_url => DriftClock
+    _clocks = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, base_url=None, time_path='auth/time', ttl=DRIFT_TTL):
+        self.base_url = base_url
+        self.time_path = time_path
+        self.ttl = ttl
+        self.time_url = '%s/%s' % (str(self.base_url).rstrip('/'),
+                                   str(self.time_path).lstrip('/'))
+        self.drift = None
+        self.synced_at = None
+        self.lock = threading.Lock()
+
+    # Return the clock shared by all the users of base_url, a given ttl
+    # (None included) replaces the one of the shared clock
+    @classmethod
+    def get(cls, base_url, time_path='auth/time', ttl=KEEP_TTL):
+        key = '%s/%s' % (str(base_url).rstrip('/'), str(time_path).lstrip('/'))
+        with cls._registry_lock:
+            clock = cls._clocks.get(key)
+            if clock is None:
+                clock = cls(base_url=base_url, time_path=time_path)
+                cls._clocks[key] = clock
+            if ttl is not KEEP_TTL:
+                clock.ttl = ttl
+        return clock
+
+    # Retrieve OVH time with a single request, session may be a
+    # requests.Session or a SessionPool. The request is bounded by the
+    # deadline of the call being sent, if any
+    def server_time(self, session=None):
+        kwargs = {}
+        current = deadline.current()
+        if current is not None:
+            kwargs['timeout'] = current.timeout()
+        request = (session or requests).get(self.time_url, **kwargs)
+        if request.status_code != requests.codes.ok:
+            raise OCAPyRequestException("Time request error: %s" %
+                                        request.json()['message'],
+                                        request=request)
+        return int(request.text)
+
+    def expired(self):
+        if self.synced_at is None or self.drift is None:
+            return True
+        if self.ttl is None:
+            return False
+        return time.time() - self.synced_at >= self.ttl
+
+    # Measure the drift, the local time is taken in the middle of the
+    # round trip to compensate the network latency
+    def sync(self, session=None):
+        with self.lock:
+            return self._sync(session)
+
+    def _sync(self, session=None):
+        before = time.time()
+        server_time = self.server_time(session)
+        after = time.time()
+        self.drift = server_time - int(round((before + after) / 2))
+        self.synced_at = after
+        logging.debug("drift for %s is %ss" % (self.base_url, self.drift))
+        return self.drift
+
+    # Return the drift, measuring it only if needed. Concurrent callers wait
+    # for a single measure instead of each doing their own
+    def get_drift(self, session=None):
+        if self.expired():
+            with self.lock:
+                if self.expired():
+                    self._sync(session)
+        return self.drift
+
+    # Force a new measure on next use, the current drift stays available
+    # until then
+    def invalidate(self):
+        self.synced_at = None
+
+    # Return the current OVH time
+    def now(self, session=None):
+        return int(time.time()) + self.get_drift(session)
+
+# vim:set shiftwidth=4 tabstop=4 softtabstop=4 encoding=utf-8 expandtab textwidth=79
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Pierre-Samuel Le Stang (ps@lestang.fr)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. module:: codec
+    :platform: Unix
+    :synopsis: JSON encoding and decoding
+
+.. moduleauthor:: Pierre-Samuel Le Stang <ps@lestang.fr>
+
+The fastest available JSON library is selected at import time: ujson, then
+simplejson, then the standard json module. The OCAPY_JSON environment
+variable or :func:`use` forces one of them.
+
+:class:`JSONView` gives a lazy access to a JSON document and
+:class:`ArrayParser` decodes the elements of a JSON array as its chunks
+arrive.
+"""
+
+import codecs
+import json
+import os
+
+# Supported libraries, the first available one is used
+LIBRARIES = ('ujson', 'simplejson', 'json')
+
+name = None
+loads = None
+dumps = None
+
+def use(library):
+    """select the JSON library used to encode and decode
+
+    :param library: one of ujson, simplejson, json
+    :raises ImportError: if the library is not available
+    """
+    global name, loads, dumps
+    module = __import__(library)
+    name = library
+    loads = module.loads
+    dumps = module.dumps
+
+def _select():
+    forced = os.environ.get('OCAPY_JSON')
+    if forced:
+        return use(forced)
+    for library in LIBRARIES:
+        try:
+            return use(library)
+        except ImportError:
+            pass
+
+_select()
+
+# Only the standard library decodes a document piece by piece
+_decoder = json.JSONDecoder()
+WHITESPACES = ' \t\n\r'
+
+
+class ArrayParser(object):
+    """Incremental parser of a JSON array
+
+    feed() chunks of the document as they arrive, it returns the elements
+    completed by the chunk. close() checks the document is complete.
+    """
+
+    def __init__(self):
+        self.buffer = u''
+        self.position = 0
+        self.started = False
+        self.finished = False
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def feed(self, chunk, final=False):
+        if isinstance(chunk, str):
+            chunk = self.decoder.decode(chunk, final)
+        # drop what has been parsed already
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return list(self._parse(final))
+
+    def close(self):
+        elements = self.feed('', final=True)
+        if not self.finished:
+            raise ValueError('Truncated JSON array')
+        return elements
+
+    def _skip(self):
+        while self.position < len(self.buffer) and \
+              self.buffer[self.position] in WHITESPACES:
+            self.position += 1
+
+    def _parse(self, final):
+        buffer = self.buffer
+        if not self.started:
+            self._skip()
+            if self.position >= len(buffer):
+                return
+            if buffer[self.position] != '[':
+                raise ValueError('Not a JSON array')
+            self.position += 1
+            self.started = True
+
+        while not self.finished:
+            self._skip()
+            if self.position >= len(buffer):
+                return
+            if buffer[self.position] == ']':
+                self.position += 1
+                self.finished = True
+                return
+            if buffer[self.position] == ',':
+                self.position += 1
+                self._skip()
+            start = self.position
+            try:
+                element, end = _decoder.raw_decode(buffer, start)
+            except ValueError:
+                if final:
+                    raise
+                # incomplete element, wait for the next chunk
+                self.position = start
+                return
+            # an element, a number for instance, is only complete once
+            # followed by a separator
+            self.position = end
+            self._skip()
+            if self.position >= len(buffer) or \
+               buffer[self.position] not in ',]':
+                if final:
+                    raise ValueError('Invalid JSON array')
+                self.position = start
+                return
+            yield element
+
+
+# Yield the elements of a JSON array document without decoding it at once
+def iter_array(document):
+    parser = ArrayParser()
+    for element in parser.feed(document):
+        yield element
+    for element in parser.close():
+        yield element
+
+
+class JSONView(object):
+    """Lazy view of a JSON document
+
+    The document is only decoded when it is used. Iterating over an array
+    or getting one of its elements by index decodes the elements one by
+    one, so the whole array is never held in memory.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self._value = None
+        self._decoded = False
+
+    @property
+    def value(self):
+        if not self._decoded:
+            self._value = loads(self.raw)
+            self._decoded = True
+        return self._value
+
+    def is_array(self):
+        return self.raw.lstrip()[:1] == '['
+
+    def __iter__(self):
+        if self._decoded or not self.is_array():
+            return iter(self.value)
+        return iter_array(self.raw)
+
+    def __getitem__(self, key):
+        if self._decoded or not self.is_array() or not isinstance(key, int) \
+           or key < 0:
+            return self.value[key]
+        for index, element in enumerate(iter_array(self.raw)):
+            if index == key:
+                return element
+        raise IndexError(key)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __repr__(self):
+        return '<JSONView %d bytes>' % len(self.raw)
+
+# vim:set shiftwidth=4 tabstop=4 softtabstop=4 encoding=utf-8 expandtab textwidth=79
@@ -33,9 +33,22 @@ import codecs
 import string
 import random
 import logging
+import threading
+import time
 
 from ConfigParser import SafeConfigParser
 
+# Seconds a profile validation request may last
+VALIDATION_TIMEOUT = 10
+# Seconds a successful profile validation is trusted
+VALIDATION_TTL = 3600
+# Number of profiles validated at the same time
+VALIDATION_WORKERS = 10
+
+# Successful validations: credentials => validation time. Failures are not
+# kept, so fixed credentials or a network back up are seen at once
+_validations = {}
+
 class Config(object):
     """Defines the main config class
     
@@ -45,7 +58,11 @@ class Config(object):
 
     """
 
-    def __init__(self):
+    # Configurations shared by cached(): file => ((mtime, size), Config)
+    _cache = {}
+    _cache_lock = threading.Lock()
+
+    def __init__(self, file=None):
         """is called when :class:`Config` is instantiated
 
     .. note::
@@ -53,12 +70,38 @@ class Config(object):
         Current user's configuration is loaded as soon as :class:`OCAPy.Config` is instantiated
 
         """
-        self.file = '%s/.ocapyrc' % os.path.expanduser('~')
+        self.file = file or '%s/.ocapyrc' % os.path.expanduser('~')
         self.profiles = []
+        # profiles by name
+        self.names = {}
         self.ocapy = None
         self.parser = None
         self.load()
 
+    @classmethod
+    def cached(cls, file=None):
+        """return the configuration of file shared by the whole process
+
+        The file is only parsed again when its modification time or its size
+        changed. The returned :class:`Config` must not be modified, create a
+        new one to add or delete profiles.
+
+        """
+        file = file or '%s/.ocapyrc' % os.path.expanduser('~')
+        try:
+            info = os.stat(file)
+            signature = (info.st_mtime, info.st_size)
+        except OSError:
+            signature = None
+
+        with cls._cache_lock:
+            cached = cls._cache.get(file)
+            if cached is not None and cached[0] == signature:
+                return cached[1]
+            config = cls(file)
+            cls._cache[file] = (signature, config)
+            return config
+
     def add_profile(self, name=None, app_key=None, app_secret=None, section=None,
                     consumer_key=None, base_url=None):
         """create a Profile instance and add it to profiles list attribute
@@ -72,22 +115,19 @@ class Config(object):
                           app_secret=app_secret, consumer_key=consumer_key,
                           base_url=base_url, section=section)
         self.profiles.append(profile)
+        if name is not None:
+            self.names.setdefault(name, profile)
         return profile
 
     def delete_profile(self, name):
         profile = self.profile(name)
         if profile is not None:
             profile.delete()
+            self.profiles.remove(profile)
+            del self.names[name]
 
     def profile(self, name):
-        profile = None
-        for profile in self.profiles:
-            if profile.name == name:
-                break
-            else:
-                profile = None
-
-        return profile
+        return self.names.get(name)
 
     def set_default(self, profile=None):
         """set default profile name to main ocapy configuration
@@ -99,11 +139,7 @@ class Config(object):
 
     def load(self):
         self.parser = SafeConfigParser()
-
-        if not os.path.exists(self.file):
-            with open(self.file, 'a') as f:
-                f.write('')
-
+        # a missing file is an empty configuration, save() creates it
         self.parser.read(self.file)
 
         for section in self.parser.sections():
@@ -116,20 +152,60 @@ class Config(object):
             if section == 'ocapy':
                 self.ocapy = OcapyConfig(parser=self.parser, **params)
             elif str(section).startswith('profile-'):
-                self.add_profile(**params)
+                profile = self.add_profile(**params)
+                profile.saved = profile.credentials()
 
         if self.ocapy is None:
             self.ocapy = OcapyConfig(parser=self.parser,
                                      base_url='https://api.ovh.com/1.0/')
 
+    def validate(self, profiles=None, timeout=VALIDATION_TIMEOUT,
+                 max_age=VALIDATION_TTL, max_workers=VALIDATION_WORKERS):
+        """validate profiles concurrently
+
+        :param profiles: the :class:`Profile` instances to validate, all the
+                         profiles by default
+        :param timeout: seconds a validation request may last
+        :param max_age: seconds a previous successful validation is trusted
+        :param max_workers: number of profiles validated at the same time
+        :return: a dict profile name => True if the profile is valid
+
+        """
+        if profiles is None:
+            profiles = self.profiles
+        return dict((profile.name, valid) for profile, valid in
+                    self._validate(profiles, timeout, max_age, max_workers))
+
+    # Validate profiles concurrently, return (profile, valid) couples in the
+    # order of profiles (unnamed profiles have no name to be told apart)
+    def _validate(self, profiles, timeout=VALIDATION_TIMEOUT,
+                  max_age=VALIDATION_TTL, max_workers=VALIDATION_WORKERS):
+        from batch import fan_out
+        results = fan_out(lambda profile: profile.is_valid(timeout=timeout,
+                                                           max_age=max_age),
+                          profiles, max_workers=max_workers)
+        return [(result.key, result.ok and result.value)
+                for result in results]
+
     def save(self):
         if self.ocapy.profile == '':
             if len(self.profiles) > 0:
                 self.ocapy.profile = self.profiles[0].name
         self.ocapy.save()
 
+        # only new and modified profiles are validated, all at once, and
+        # their results are given to save()
+        validations = dict(self._validate([profile for profile
+                                           in self.profiles
+                                           if profile.saved !=
+                                           profile.credentials()]))
+
         for profile in self.profiles:
-            profile.save()
+            profile.save(valid=validations.get(profile))
+        # names of the unnamed profiles are chosen by save()
+        self.names = {}
+        for profile in self.profiles:
+            self.names.setdefault(profile.name, profile)
 
         with open(self.file, 'w') as f:
             self.parser.write(f)
@@ -137,6 +213,9 @@ class Config(object):
         if sys.platform.startswith('linux'):
             os.chmod(self.file, stat.S_IRUSR | stat.S_IWUSR)
 
+        with self._cache_lock:
+            self._cache.pop(self.file, None)
+
 class OcapyConfig(object):
     """Config parameters for Ocapy"""
 
@@ -165,12 +244,16 @@ class Profile(object):
         self.base_url = base_url
         self.parser = parser
         self.section = section
+        # credentials as they are in the configuration file
+        self.saved = None
 
         if not self.parser.has_section(self.section) and self.section is not None:
             self.parser.add_section(self.section)
 
 
-    def save(self):
+    # valid is the result of a validation already done, None to validate
+    # the profile unless its credentials are unchanged
+    def save(self, valid=None):
         if self.name is None or self.name == '':
             if self.section is not None:
                 self.parser.remove_section(self.section)
@@ -183,13 +266,17 @@ class Profile(object):
             self.section = 'profile-%s' % self.name
             self.parser.add_section(self.section)
 
-        if self.is_valid():
+        # unchanged credentials are not validated again
+        if valid is None:
+            valid = self.saved == self.credentials() or self.is_valid()
+        if valid:
             if self.parser.has_section(self.section):
                 self.parser.set(self.section, 'name', self.name)
                 self.parser.set(self.section, 'app_key', self.app_key)
                 self.parser.set(self.section, 'app_secret', self.app_secret)
                 self.parser.set(self.section, 'consumer_key', self.consumer_key)
                 self.parser.set(self.section, 'base_url', self.base_url)
+                self.saved = self.credentials()
         else:
             logging.warning('Profile not valid, removing ....')
             self.delete()
@@ -197,19 +284,43 @@ class Profile(object):
     def delete(self):
         self.parser.remove_section(self.section)
 
-    def is_valid(self):
+    def credentials(self):
+        return (self.base_url, self.app_key, self.app_secret,
+                self.consumer_key)
+
+    def is_valid(self, timeout=VALIDATION_TIMEOUT, max_age=VALIDATION_TTL):
+        """check the profile credentials with a request to the API
+
+        :param timeout: seconds the request may last
+        :param max_age: seconds a previous success for the same credentials
+                        is trusted, 0 to always make the request
+        :return: True if the profile is valid
+
+        """
+        credentials = self.credentials()
+        validated = _validations.get(credentials)
+        if validated is not None and time.time() - validated < max_age:
+            return True
+
         from OCAPy import OCAPy
         ocapy = OCAPy(base_url=self.base_url, app_key=self.app_key,
                       app_secret=self.app_secret,
                       consumer_key=self.consumer_key)
 
+        valid = True
         try:
-            ocapy.me.get()
+            ocapy.me.get(deadline=timeout, cache=False, coalesce=False)
         except Exception as e:
-            logging.error('Profile validation error: %s' % e)
-            return False
+            logging.error('Profile "%s" validation error: %s' % (self.name, e))
+            valid = False
+        finally:
+            ocapy.sessions.close()
 
-        return True
+        if valid:
+            _validations[credentials] = time.time()
+        else:
+            _validations.pop(credentials, None)
+        return valid
 
     def __str__(self):
         name = 'Name'
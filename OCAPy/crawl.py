@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Pierre-Samuel Le Stang (ps@lestang.fr)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. module:: crawl
+    :platform: Unix
+    :synopsis: Snapshot of a whole account guided by the schemas
+
+.. moduleauthor:: Pierre-Samuel Le Stang <ps@lestang.fr>
+
+A :class:`Crawler` GETs every resource of an account reachable from the
+schemas, breadth first: the list resources, then the items of the lists,
+then their sub resources. The responses are written to NDJSON shards of a
+directory and the progress is saved to the same directory, so an
+interrupted crawl is resumed without fetching again what was written::
+
+    crawler = Crawler(ocapy, '/var/backups/ovh/2013-10-01',
+                      prefixes=['/dedicated', '/domain'])
+    report = crawler.run()
+    for record in crawler.records():
+        print record['path'], record.get('value', record.get('error'))
+
+"""
+
+import glob
+import itertools
+import json
+import os
+import time
+
+import batch
+import codec
+from schema import SchemaStore
+
+# Number of records of a shard
+SHARD_SIZE = 10000
+# Number of resources visited between two checkpoints
+CHECKPOINT_EVERY = 500
+
+
+class CrawlReport(object):
+    """What a crawl did, from its first run"""
+
+    def __init__(self, state, resumed, duration):
+        self.records = state['records']
+        self.errors = state['errors']
+        self.levels = state['level'] + 1
+        self.shards = state['shard'] + 1
+        self.resumed = resumed
+        self.duration = duration
+
+    def __repr__(self):
+        return '<CrawlReport: %d records, %d errors, %d levels, %d shards%s>' \
+               % (self.records, self.errors, self.levels, self.shards,
+                  ', resumed' if self.resumed else '')
+
+
+class Crawler(object):
+    """GETs all the resources described by the schemas of an API
+
+    Each resource is written as a {"path", "template", "value"} record, or
+    {"path", "template", "error"} if its request failed, to the shards
+    shard-00000.ndjson, shard-00001.ndjson... of directory.
+
+    The resources of a level are listed in a level-N.ndjson file, each
+    visited resource appends its sub resources to the file of the next
+    level. The checkpoint file stores how many resources of the current
+    level were visited and the sizes of the files at that time: resuming
+    truncates the files to these sizes, so the records written after the
+    last checkpoint are written once again, not twice.
+
+    Only the GET operations without required query parameters are run, the
+    ids of the variable segments come from the responses of the list
+    resources.
+    """
+
+    def __init__(self, api, directory, store=None, prefixes=None,
+                 max_workers=batch.MAX_WORKERS, shard_size=SHARD_SIZE,
+                 checkpoint_every=CHECKPOINT_EVERY):
+        self.api = api
+        self.directory = directory
+        self.store = store or SchemaStore(base_url=api.base_url,
+                                          max_workers=max_workers)
+        # only the paths starting with one of the prefixes are crawled
+        self.prefixes = [prefix.rstrip('/') for prefix in prefixes or []]
+        self.max_workers = max_workers
+        self.shard_size = shard_size
+        self.checkpoint_every = checkpoint_every
+
+    @property
+    def checkpoint_file(self):
+        return os.path.join(self.directory, 'checkpoint.json')
+
+    def level_file(self, level):
+        return os.path.join(self.directory, 'level-%d.ndjson' % level)
+
+    def shard_file(self, shard):
+        return os.path.join(self.directory, 'shard-%05d.ndjson' % shard)
+
+    def run(self):
+        """crawl the API, or resume the interrupted crawl of directory
+
+        :return: a :class:`CrawlReport`
+
+        """
+        started = time.time()
+        if not self.store.operations:
+            self.store.ensure()
+        state = self._load()
+        resumed = state is not None
+        if state is None:
+            state = self._start()
+        else:
+            self._truncate(state)
+
+        while not state['finished']:
+            self._crawl_level(state)
+        return CrawlReport(state, resumed, time.time() - started)
+
+    # Yield the records of the shards
+    def records(self):
+        for filename in sorted(glob.glob(os.path.join(self.directory,
+                                                      'shard-*.ndjson'))):
+            with open(filename, 'rb') as f:
+                for line in f:
+                    yield codec.loads(line)
+
+    def _start(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        # the root of the segments tree is the only resource of level 0
+        with open(self.level_file(0), 'wb') as f:
+            f.write('[]\n')
+        open(self.shard_file(0), 'wb').close()
+        state = {'level': 0, 'done': 0, 'next': 0, 'shard': 0,
+                 'shard_bytes': 0, 'shard_records': 0, 'records': 0,
+                 'errors': 0, 'finished': False}
+        self._save(state)
+        return state
+
+    # Visit the resources of the current level from the checkpoint, then go
+    # to the next level
+    def _crawl_level(self, state):
+        shard = open(self.shard_file(state['shard']), 'ab')
+        try:
+            with open(self.level_file(state['level']), 'rb') as entries, \
+                 open(self.level_file(state['level'] + 1), 'ab') as following:
+                lines = itertools.islice(entries, state['done'], None)
+                while True:
+                    chunk = [json.loads(line) for line in
+                             itertools.islice(lines, self.checkpoint_every)]
+                    if not chunk:
+                        break
+                    for result in batch.as_completed(self._visit, chunk,
+                                                     self.max_workers):
+                        if not result.ok:
+                            raise result.error
+                        record, children = result.value
+                        if record is not None:
+                            if state['shard_records'] >= self.shard_size:
+                                shard.close()
+                                state['shard'] += 1
+                                state['shard_records'] = 0
+                                shard = open(self.shard_file(state['shard']),
+                                             'ab')
+                            shard.write(codec.dumps(record) + '\n')
+                            state['shard_records'] += 1
+                            state['records'] += 1
+                            if 'error' in record:
+                                state['errors'] += 1
+                        for segments in children:
+                            following.write(json.dumps(segments) + '\n')
+                    state['done'] += len(chunk)
+                    state['shard_bytes'] = sync(shard)
+                    state['next'] = sync(following)
+                    self._save(state)
+        finally:
+            shard.close()
+
+        if state['next'] == 0:
+            state['finished'] = True
+            self._save(state)
+            os.remove(self.level_file(state['level']))
+            os.remove(self.level_file(state['level'] + 1))
+        else:
+            state['level'] += 1
+            state['done'] = 0
+            state['next'] = 0
+            self._save(state)
+            os.remove(self.level_file(state['level'] - 1))
+
+    # Visit a resource given by its segments, a list of [name, variable]:
+    # GET it if its schema allows it and return its record (None if it is
+    # not fetched) and the segments of its sub resources
+    def _visit(self, segments):
+        node = self._node(segments)
+        if node is None:
+            return None, []
+        record = None
+        value = None
+        if self._fetchable(node):
+            resource = self._resource(segments)
+            record = {'path': resource.path, 'template': node['']}
+            try:
+                value = resource.get(cache=False)
+                record['value'] = value
+            except Exception as e:
+                record['error'] = str(e)
+
+        children = [segments + [[name, False]] for name in sorted(node)
+                    if name not in ('', '*')]
+        # the ids of a variable segment are the items of the list
+        if '*' in node and isinstance(value, list):
+            children.extend(segments + [[id, True]] for id in value)
+        return record, [child for child in children if self._wanted(child)]
+
+    # Return the segments tree node of a resource, None if the schemas do
+    # not describe it (anymore)
+    def _node(self, segments):
+        node = self.store.node('/')
+        for name, variable in segments:
+            if node is None:
+                return None
+            node = node.get('*' if variable else name)
+        return node
+
+    # A node is fetched if it has a GET operation needing no query parameter
+    def _fetchable(self, node):
+        if '' not in node:
+            return False
+        operation = self.store.operation(node[''], 'GET')
+        if operation is None:
+            return False
+        return all(parameter.get('paramType') == 'path' or
+                   not parameter.get('required')
+                   for parameter in operation.get('parameters') or [])
+
+    def _resource(self, segments):
+        resource = self.api
+        for name, variable in segments:
+            if variable:
+                resource = resource(name)
+            elif resource is self.api:
+                resource = getattr(resource, name)
+            else:
+                # a segment may be called like a Resource attribute (name,
+                # path...)
+                resource = resource._child(name)
+        return resource
+
+    def _wanted(self, segments):
+        if not self.prefixes:
+            return True
+        path = '/' + '/'.join(unicode(name) for name, variable in segments)
+        return any(path == prefix or path.startswith(prefix + '/') or
+                   prefix.startswith(path + '/') for prefix in self.prefixes)
+
+    def _load(self):
+        try:
+            with open(self.checkpoint_file, 'rb') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    # Drop what was written after the checkpoint
+    def _truncate(self, state):
+        for filename in glob.glob(os.path.join(self.directory,
+                                               'shard-*.ndjson')):
+            if filename > self.shard_file(state['shard']):
+                os.remove(filename)
+        files = [(self.shard_file(state['shard']), state['shard_bytes'])]
+        if not state['finished']:
+            files.append((self.level_file(state['level'] + 1), state['next']))
+        for filename, size in files:
+            if os.path.exists(filename):
+                with open(filename, 'r+b') as f:
+                    f.truncate(size)
+
+    # The checkpoint is written then renamed so it is never partial
+    def _save(self, state):
+        tmp = '%s.tmp' % self.checkpoint_file
+        with open(tmp, 'wb') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, self.checkpoint_file)
+
+
+# Write the buffered data of a file to the disk, return the file size
+def sync(f):
+    f.flush()
+    os.fsync(f.fileno())
+    return os.fstat(f.fileno()).st_size
+
+# vim:set shiftwidth=4 tabstop=4 softtabstop=4 encoding=utf-8 expandtab textwidth=79
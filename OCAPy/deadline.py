@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Pierre-Samuel Le Stang (ps@lestang.fr)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. module:: deadline
+    :platform: Unix
+    :synopsis: Time budget of a call
+
+.. moduleauthor:: Pierre-Samuel Le Stang <ps@lestang.fr>
+
+A :class:`Deadline` is the time left to a call. It is shared by all the
+steps of the call: drift synchronisation, connection, response reading,
+retries and the waits between them. The deadline of the call being sent by
+a thread is available to the code it runs (the time request of the
+DriftClock) with :func:`current`.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+from errors import OCAPyTimeoutException
+
+# The deadline of the call being sent by the current thread
+_local = threading.local()
+
+def current():
+    return getattr(_local, 'deadline', None)
+
+# Make deadline the current one of the thread while the block runs
+@contextmanager
+def scope(deadline):
+    previous = current()
+    _local.deadline = deadline
+    try:
+        yield deadline
+    finally:
+        _local.deadline = previous
+
+
+class Deadline(object):
+    """The time left to a call of seconds"""
+
+    def __init__(self, seconds, what='Request'):
+        self.seconds = seconds
+        self.what = what
+        self.expires = time.time() + seconds
+
+    def remaining(self):
+        return self.expires - time.time()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    # Raise OCAPyTimeoutException if the deadline expired
+    def check(self):
+        if self.expired():
+            raise self.error()
+
+    def error(self):
+        return OCAPyTimeoutException('%s not done after %ss' %
+                                     (self.what, self.seconds))
+
+    # Return the timeout of the next network operation
+    def timeout(self):
+        self.check()
+        return self.remaining()
+
+    def __repr__(self):
+        return '<Deadline %s: %.3fs left>' % (self.what, self.remaining())
+
+# vim:set shiftwidth=4 tabstop=4 softtabstop=4 encoding=utf-8 expandtab textwidth=79
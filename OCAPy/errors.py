@@ -29,6 +29,22 @@ class OCAPyRequestException(OCAPyException):
         OCAPyException.__init__(self, message)
         self.request=request
 
+class OCAPyTimeoutException(OCAPyRequestException):
+    """Defines the exception for requests whose deadline expired"""
+    pass
+
+class OCAPyCancelledException(OCAPyException):
+    """Defines the exception for cancelled requests"""
+    pass
+
+class OCAPyValidationException(OCAPyException):
+    """Defines the exception for requests refused by client side validation"""
+    pass
+
+class OCAPyCassetteException(OCAPyException):
+    """Defines the exception for requests without recorded response"""
+    pass
+
 class OCAPyConfigException(OCAPyException):
     """Defines the exception class for OCAPy Config classes"""
     pass
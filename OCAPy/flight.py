@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Pierre-Samuel Le Stang (ps@lestang.fr)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+
+from errors import OCAPyTimeoutException
+
+class Flight(object):
+    """A call in progress, its outcome is shared by all its waiters"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    """Coalesces identical concurrent calls
+
+    While a call identified by a key is in progress, the same call made by
+    other threads waits for it and gets its value, or raises its exception,
+    instead of being made again. Nothing is kept once the call is done.
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.lock = threading.Lock()
+
+    # Call function unless a call of key is in progress, return the value
+    # and whether it comes from another thread's call. The call of another
+    # thread is waited for at most timeout seconds
+    def do(self, key, function, timeout=None):
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+            else:
+                flight.waiters += 1
+
+        if not leader:
+            if not flight.done.wait(timeout):
+                raise OCAPyTimeoutException('Shared call not done after %ss'
+                                            % timeout)
+            if flight.error is not None:
+                raise flight.error
+            return flight.value, True
+
+        try:
+            flight.value = function()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+        return flight.value, False
+
+    def __len__(self):
+        return len(self.flights)
+
+# The calls of all the OCAPy instances are coalesced together, their keys
+# hold the base URL and the credentials
+shared = SingleFlight()
+
+# vim:set shiftwidth=4 tabstop=4 softtabstop=4 encoding=utf-8 expandtab textwidth=79
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Pierre-Samuel Le Stang (ps@lestang.fr)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. module:: metrics
+    :platform: Unix
+    :synopsis: Requests instrumentation
+
+.. moduleauthor:: Pierre-Samuel Le Stang <ps@lestang.fr>
+
+An :class:`Instrumentation` given to OCAPy calls its hooks before each
+request (pre_request), after each response (post_response) and on each
+error (error) with the :class:`Call` being made. :class:`Metrics` is a hook
+which counts the calls and keeps latency histograms per path template,
+:class:`JsonLines` is a hook which writes each call to a file::
+
+    metrics = Metrics()
+    instrumentation = Instrumentation(hooks=[metrics, JsonLines('/tmp/calls')])
+    ocapy = OCAPy(ocapy_profile='default', instrumentation=instrumentation)
+    ...
+    print metrics.prometheus()
+
+"""
+
+import bisect
+import json
+import logging
+import threading
+import time
+
+# Phases of a call: time synchronisation, signature, network (including
+# retries) and JSON decoding
+PHASES = ('sync', 'sign', 'network', 'decode')
+
+# Latency histograms buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# The call being made by the current thread
+_local = threading.local()
+
+def current():
+    return getattr(_local, 'call', None)
+
+
+class Call(object):
+    """A request made through a Resource"""
+
+    def __init__(self, method=None, path=None, template=None, params=None):
+        self.method = str(method).upper()
+        self.path = path
+        self.template = template
+        self.params = params
+        self.status = None
+        self.cached = False
+        self.coalesced = False
+        self.error = None
+        self.started = time.time()
+        self.duration = None
+        self.phases = dict.fromkeys(PHASES, 0.0)
+
+    # Add duration to a phase
+    def add(self, phase, duration):
+        self.phases[phase] += duration
+
+    def as_dict(self):
+        return {'method': self.method, 'path': self.path,
+                'template': self.template, 'status': self.status,
+                'cached': self.cached, 'coalesced': self.coalesced,
+                'started': self.started,
+                'duration': self.duration, 'phases': self.phases,
+                'error': str(self.error) if self.error is not None else None}
+
+
+class Instrumentation(object):
+    """Calls hooks around the requests
+
+    A hook is any object with some of the pre_request, post_response and
+    error methods, each one is called with the Call. A failing hook is
+    logged and does not fail the request.
+    """
+
+    def __init__(self, hooks=None):
+        self.hooks = {'pre_request': [], 'post_response': [], 'error': []}
+        for hook in hooks or []:
+            self.add(hook)
+
+    def add(self, hook):
+        for event in self.hooks:
+            function = getattr(hook, event, None)
+            if function is not None:
+                self.hooks[event].append(function)
+
+    # Register a function for a single event
+    def on(self, event, function):
+        self.hooks[event].append(function)
+
+    def _fire(self, event, call):
+        for function in self.hooks[event]:
+            try:
+                function(call)
+            except Exception as e:
+                logging.warning('%s hook failed: %s' % (event, e))
+
+    def start(self, resource, method, params=None):
+        call = Call(method=method, path=resource.path,
+                    template=resource.template, params=params)
+        _local.call = call
+        self._fire('pre_request', call)
+        return call
+
+    def finish(self, call):
+        _local.call = None
+        call.duration = time.time() - call.started
+        self._fire('post_response', call)
+
+    def fail(self, call, error):
+        _local.call = None
+        call.duration = time.time() - call.started
+        call.error = error
+        status = getattr(getattr(error, 'request', None), 'status_code', None)
+        if status is not None:
+            call.status = status
+        self._fire('error', call)
+
+
+class Histogram(object):
+    """Counts of values per bucket"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    # Return the upper bound of the bucket holding the q quantile (0 < q < 1)
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                if index < len(self.buckets):
+                    return self.buckets[index]
+                break
+        return float('inf')
+
+    # Cumulative counts, as prometheus wants them
+    def cumulative(self):
+        total = 0
+        counts = []
+        for count in self.counts:
+            total += count
+            counts.append(total)
+        return counts
+
+    def as_dict(self):
+        return {'count': self.count, 'sum': self.sum,
+                'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'],
+                                    self.cumulative()))}
+
+
+class Endpoint(object):
+    """Metrics of a method and path template"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.count = 0
+        self.errors = 0
+        self.cached = 0
+        self.status = {}
+        self.latency = Histogram(buckets)
+        self.phases = dict((phase, Histogram(buckets)) for phase in PHASES)
+
+    def as_dict(self):
+        return {'count': self.count, 'errors': self.errors,
+                'cached': self.cached, 'status': dict(self.status),
+                'latency': self.latency.as_dict(),
+                'phases': dict((phase, histogram.as_dict()) for phase,
+                               histogram in self.phases.items())}
+
+
+class Metrics(object):
+    """Counters and latency histograms per method and path template"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.endpoints = {}
+        self.lock = threading.Lock()
+
+    def post_response(self, call):
+        self.observe(call)
+
+    def error(self, call):
+        self.observe(call)
+
+    def observe(self, call):
+        key = (call.method, call.template)
+        with self.lock:
+            endpoint = self.endpoints.get(key)
+            if endpoint is None:
+                endpoint = self.endpoints[key] = Endpoint(self.buckets)
+            endpoint.count += 1
+            if call.error is not None:
+                endpoint.errors += 1
+            if call.cached:
+                endpoint.cached += 1
+            status = str(call.status)
+            endpoint.status[status] = endpoint.status.get(status, 0) + 1
+            endpoint.latency.observe(call.duration)
+            for phase, duration in call.phases.items():
+                endpoint.phases[phase].observe(duration)
+
+    # Return the q quantile of the latency of a method and template, None if
+    # there is no call yet
+    def quantile(self, method, template, q):
+        endpoint = self.endpoints.get((str(method).upper(), template))
+        if endpoint is None:
+            return None
+        return endpoint.latency.quantile(q)
+
+    # Metrics as a dict: 'METHOD template' => endpoint metrics
+    def as_dict(self):
+        with self.lock:
+            return dict(('%s %s' % key, endpoint.as_dict())
+                        for key, endpoint in self.endpoints.items())
+
+    # Metrics in prometheus text format
+    def prometheus(self, prefix='ocapy'):
+        lines = []
+        with self.lock:
+            endpoints = sorted(self.endpoints.items())
+
+            lines.append('# TYPE %s_requests_total counter' % prefix)
+            for (method, template), endpoint in endpoints:
+                for status, count in sorted(endpoint.status.items()):
+                    lines.append('%s_requests_total{%s,status="%s"} %d' %
+                                 (prefix, labels(method, template), status,
+                                  count))
+
+            lines.append('# TYPE %s_cached_requests_total counter' % prefix)
+            for (method, template), endpoint in endpoints:
+                lines.append('%s_cached_requests_total{%s} %d' %
+                             (prefix, labels(method, template),
+                              endpoint.cached))
+
+            name = '%s_request_duration_seconds' % prefix
+            lines.append('# TYPE %s histogram' % name)
+            for (method, template), endpoint in endpoints:
+                histogram_lines(lines, name, labels(method, template),
+                                endpoint.latency)
+
+            name = '%s_request_phase_seconds' % prefix
+            lines.append('# TYPE %s histogram' % name)
+            for (method, template), endpoint in endpoints:
+                for phase in PHASES:
+                    histogram_lines(lines, name, '%s,phase="%s"' %
+                                    (labels(method, template), phase),
+                                    endpoint.phases[phase])
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {}
+
+
+class Latencies(object):
+    """Latency histograms of the attempts per path template, fed without
+    instrumentation (used to choose when to hedge a GET)"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def observe(self, template, duration):
+        with self.lock:
+            histogram = self.histograms.get(template)
+            if histogram is None:
+                histogram = self.histograms[template] = Histogram(self.buckets)
+            histogram.observe(duration)
+
+    # Return the q quantile of the latency of template, None if there are
+    # less than min_count values
+    def quantile(self, template, q, min_count=1):
+        with self.lock:
+            histogram = self.histograms.get(template)
+            if histogram is None or histogram.count < max(1, min_count):
+                return None
+            return histogram.quantile(q)
+
+
+def labels(method, template):
+    template = str(template).replace('\\', '\\\\').replace('"', '\\"')
+    return 'method="%s",template="%s"' % (method, template)
+
+def histogram_lines(lines, name, labels, histogram):
+    bounds = [str(bucket) for bucket in histogram.buckets] + ['+Inf']
+    for bound, count in zip(bounds, histogram.cumulative()):
+        lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, count))
+    lines.append('%s_sum{%s} %f' % (name, labels, histogram.sum))
+    lines.append('%s_count{%s} %d' % (name, labels, histogram.count))
+
+
+class JsonLines(object):
+    """Writes each call as a JSON line to a file"""
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.file = open(filename, 'a')
+        self.lock = threading.Lock()
+
+    def post_response(self, call):
+        self.write(call)
+
+    def error(self, call):
+        self.write(call)
+
+    def write(self, call):
+        line = json.dumps(call.as_dict())
+        with self.lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+# vim:set shiftwidth=4 tabstop=4 softtabstop=4 encoding=utf-8 expandtab textwidth=79
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Pierre-Samuel Le Stang (ps@lestang.fr)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. module:: mirror
+    :platform: Unix
+    :synopsis: Local copy of list resources
+
+.. moduleauthor:: Pierre-Samuel Le Stang <ps@lestang.fr>
+
+A :class:`Mirror` keeps a copy of list resources and of their items in a
+sqlite database. Each sync() GETs the ids of the list, drops the removed
+items and only GETs the new items and the ones whose copy expired::
+
+    mirror = Mirror(ocapy, '/var/lib/reports/ovh.db', max_age=86400)
+    mirror.sync(ocapy.dedicated.server, children=['ips'],
+                index=['datacenter', 'state'])
+    mirror.sync(ocapy.ip)
+
+    # no request to the API
+    for id, server in mirror.find('/dedicated/server', datacenter='rbx2'):
+        print id, mirror.get('/dedicated/server/%s/ips' % id)
+
+"""
+
+import json
+import os
+import random
+import sqlite3
+import time
+
+import batch
+import codec
+
+# Default number of seconds an item copy is used before being fetched again
+MAX_AGE = 3600
+# The age of each copy is drawn between (1 - JITTER) * max_age and max_age,
+# so items copied together do not all expire at the same run
+JITTER = 0.25
+
+
+class SyncReport(object):
+    """What a sync() of a list resource did"""
+
+    def __init__(self, path):
+        self.path = path
+        self.added = []
+        self.removed = []
+        self.refreshed = []
+        self.unchanged = 0
+        # batch.Result of the items which could not be fetched
+        self.errors = []
+        self.duration = None
+
+    def __repr__(self):
+        return '<SyncReport %s: %d added, %d removed, %d refreshed, ' \
+               '%d unchanged, %d errors>' % (self.path, len(self.added),
+                                             len(self.removed),
+                                             len(self.refreshed),
+                                             self.unchanged, len(self.errors))
+
+
+class Mirror(object):
+    """Copy of list resources and of their items in a sqlite database
+
+    Items are identified by their path, the responses are stored as they
+    are received. The fields given to sync() as index are stored in an
+    indexed table to be searched by find().
+    """
+
+    def __init__(self, api, filename=None, max_age=MAX_AGE,
+                 max_workers=batch.MAX_WORKERS):
+        self.api = api
+        self.filename = filename or '%s/.ocapy.mirror' % \
+                        os.path.expanduser('~')
+        self.max_age = max_age
+        self.max_workers = max_workers
+        self.db = sqlite3.connect(self.filename, check_same_thread=False)
+        # the indexed fields of a list are kept for the next syncs
+        self.db.execute('CREATE TABLE IF NOT EXISTS list (path TEXT PRIMARY '
+                        'KEY, synced REAL, fields TEXT)')
+        # items have a list and an id, sub resources of an item a parent
+        self.db.execute('CREATE TABLE IF NOT EXISTS item (path TEXT PRIMARY '
+                        'KEY, list TEXT, id, parent TEXT, content TEXT, '
+                        'fetched REAL, expires REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS item_list ON item (list, '
+                        'id)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS item_expires ON item '
+                        '(list, expires)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS item_parent ON item '
+                        '(parent)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS field (path TEXT, list '
+                        'TEXT, name TEXT, value TEXT)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS field_value ON field '
+                        '(list, name, value)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS field_path ON field '
+                        '(path)')
+        self.db.commit()
+
+    def sync(self, resource, children=(), index=None, max_age=None,
+             limit=None):
+        """update the copy of a list resource
+
+        :param resource: the list resource, ex: ocapy.dedicated.server
+        :param children: names of the sub resources of each item to copy
+                         too, ex: ['ips']
+        :param index: names of the items fields searchable by find(),
+                      default is the ones of the previous sync. Changing
+                      them indexes the stored items again, without request
+        :param max_age: seconds the copies fetched by this sync are used,
+                        default is the one of the mirror
+        :param limit: maximum number of expired items fetched again, the
+                      oldest first, default is all of them
+        :return: a :class:`SyncReport`
+
+        """
+        started = time.time()
+        max_age = self.max_age if max_age is None else max_age
+        report = SyncReport(resource.path)
+        row = self.db.execute('SELECT fields FROM list WHERE path = ?',
+                              (resource.path,)).fetchone()
+        indexed = json.loads(row[0]) if row and row[0] else []
+        if index is None:
+            index = indexed
+        elif sorted(index) != sorted(indexed):
+            self._reindex(resource.path, index)
+        ids = resource.get(cache=False)
+
+        known = dict(self.db.execute('SELECT id, path FROM item WHERE list = '
+                                     '?', (resource.path,)))
+        current = set(ids)
+        for id, path in known.items():
+            if id not in current:
+                self._delete(path)
+                report.removed.append(id)
+
+        added = [id for id in ids if id not in known]
+        expired = [row[0] for row in self.db.execute(
+            'SELECT id FROM item WHERE list = ? AND expires <= ? ORDER BY '
+            'expires', (resource.path, started))
+            if row[0] in current]
+        if limit is not None:
+            expired = expired[:limit]
+        report.unchanged = len(known) - len(report.removed) - len(expired)
+
+        fetch = lambda id: self._fetch(resource(id), children)
+        for result in batch.as_completed(fetch, added + expired,
+                                         max_workers=self.max_workers):
+            if not result.ok:
+                report.errors.append(result)
+                continue
+            self._store(resource.path, result.key, result.value, index,
+                        max_age)
+            if result.key in known:
+                report.refreshed.append(result.key)
+            else:
+                report.added.append(result.key)
+
+        self.db.execute('INSERT OR REPLACE INTO list VALUES (?, ?, ?)',
+                        (resource.path, time.time(), json.dumps(list(index))))
+        self.db.commit()
+        report.duration = time.time() - started
+        return report
+
+    # GET an item and its sub resources, return their paths and raw
+    # responses
+    def _fetch(self, item, children):
+        # a child may be called like a Resource attribute (api, get...)
+        resources = [item] + [item._child(name) for name in children]
+        return [(resource.path,
+                 resource.get(raw=True, cache=False).decode('utf-8'))
+                for resource in resources]
+
+    def _store(self, list_path, id, contents, index, max_age):
+        fetched = time.time()
+        expires = fetched + max_age * random.uniform(1 - JITTER, 1)
+        path, content = contents[0]
+        self._delete(path)
+        self.db.execute('INSERT INTO item VALUES (?, ?, ?, NULL, ?, ?, ?)',
+                        (path, list_path, id, content, fetched, expires))
+        for child, content in contents[1:]:
+            self.db.execute('INSERT INTO item VALUES (?, NULL, NULL, ?, ?, '
+                            '?, ?)', (child, path, content, fetched, expires))
+        self._index(path, list_path, contents[0][1], index)
+
+    # Store the fields of index of an item
+    def _index(self, path, list_path, content, index):
+        if not index:
+            return
+        value = codec.loads(content)
+        if isinstance(value, dict):
+            self.db.executemany('INSERT INTO field VALUES (?, ?, ?, ?)',
+                                [(path, list_path, name, field(value[name]))
+                                 for name in index if name in value])
+
+    # Index the stored items of a list on other fields, from their copies:
+    # the items which are not fetched again are found by find() too
+    def _reindex(self, list_path, index):
+        self.db.execute('DELETE FROM field WHERE list = ?', (list_path,))
+        for path, content in self.db.execute('SELECT path, content FROM '
+                                             'item WHERE list = ?',
+                                             (list_path,)).fetchall():
+            self._index(path, list_path, content, index)
+
+    # Drop an item, its sub resources and its fields
+    def _delete(self, path):
+        self.db.execute('DELETE FROM item WHERE path = ? OR parent = ?',
+                        (path, path))
+        self.db.execute('DELETE FROM field WHERE path = ?', (path,))
+
+    # Reading the mirror
+
+    # Return the copy of path (an item or one of its sub resources), None if
+    # there is none
+    def get(self, path):
+        row = self.db.execute('SELECT content FROM item WHERE path = ?',
+                              (path,)).fetchone()
+        if row is None:
+            return None
+        return codec.loads(row[0])
+
+    # Return the ids of the copied items of a list resource
+    def ids(self, list_path):
+        return [row[0] for row in self.db.execute(
+            'SELECT id FROM item WHERE list = ? ORDER BY id', (list_path,))]
+
+    # Yield the (id, content) of the copied items of a list resource
+    def items(self, list_path):
+        for id, content in self.db.execute('SELECT id, content FROM item '
+                                           'WHERE list = ? ORDER BY id',
+                                           (list_path,)):
+            yield id, codec.loads(content)
+
+    # Yield the (id, content) of the items of a list resource whose fields
+    # have the given values, the fields must have been indexed by sync():
+    # mirror.find('/dedicated/server', datacenter='rbx2', state='ok')
+    def find(self, list_path, **fields):
+        query = 'SELECT id, content FROM item WHERE list = ?'
+        args = [list_path]
+        for name, value in sorted(fields.items()):
+            query += ' AND path IN (SELECT path FROM field WHERE list = ? ' \
+                     'AND name = ? AND value = ?)'
+            args.extend([list_path, name, field(value)])
+        for id, content in self.db.execute(query + ' ORDER BY id', args):
+            yield id, codec.loads(content)
+
+    # Return the time of the last sync of a list resource, None if never
+    def synced(self, list_path):
+        row = self.db.execute('SELECT synced FROM list WHERE path = ?',
+                              (list_path,)).fetchone()
+        return row[0] if row is not None else None
+
+    def close(self):
+        self.db.close()
+
+
+# Indexed field values are stored as JSON
+def field(value):
+    return json.dumps(value, sort_keys=True)
+
+# vim:set shiftwidth=4 tabstop=4 softtabstop=4 encoding=utf-8 expandtab textwidth=79
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Pierre-Samuel Le Stang (ps@lestang.fr)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_tz, mktime_tz
+
+# Default number of retries of a throttled/failed request and base delay
+# (in seconds) between two retries
+RETRIES = 3
+BACKOFF = 0.5
+MAX_BACKOFF = 30
+
+class TokenBucket(object):
+    """Allows rate requests per second, with bursts of up to burst requests
+
+    A bucket is shared by all the users of the same key (the application
+    key), whatever their thread or OCAPy instance.
+    """
+
+    # buckets registry: key => TokenBucket
+    _buckets = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1, rate))
+        self.tokens = self.burst
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    # Return the bucket of key, rate and burst replace the ones of an
+    # existing bucket
+    @classmethod
+    def get(cls, key, rate, burst=None):
+        with cls._registry_lock:
+            bucket = cls._buckets.get(key)
+            if bucket is None:
+                bucket = cls(rate, burst=burst)
+                cls._buckets[key] = bucket
+            else:
+                bucket.rate = float(rate)
+                bucket.burst = float(burst or max(1, rate))
+        return bucket
+
+    # Take a token, waiting for it if needed. Return the time waited. With a
+    # deadline, raise its error instead of waiting past it
+    def acquire(self, deadline=None):
+        waited = 0
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens +
+                                  (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            if deadline is not None and wait >= deadline.remaining():
+                raise deadline.error()
+            time.sleep(wait)
+            waited += wait
+
+
+class Scheduler(object):
+    """Throttles and retries the requests of an API
+
+    When rate is set, requests are sent at most rate per second using the
+    token bucket of key. Throttled (429) requests and, unless they are POST
+    requests, server errors (5xx) are retried up to retries times, waiting
+    for the Retry-After delay given by the server or for a jittered
+    exponential backoff.
+    """
+
+    def __init__(self, rate=None, burst=None, key=None, retries=RETRIES,
+                 backoff=BACKOFF, max_backoff=MAX_BACKOFF):
+        self.bucket = None
+        if rate:
+            self.bucket = TokenBucket.get(key, rate, burst=burst)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def should_retry(self, method, response):
+        if response.status_code == 429:
+            return True
+        return response.status_code >= 500 and str(method).upper() != 'POST'
+
+    # Return the number of seconds to wait before the attempt-th retry
+    def delay(self, attempt, response=None):
+        retry_after = None
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+        if retry_after:
+            try:
+                return min(self.max_backoff, max(0, float(retry_after)))
+            except ValueError:
+                date = parsedate_tz(retry_after)
+                if date is not None:
+                    return min(self.max_backoff,
+                               max(0, mktime_tz(date) - time.time()))
+        # full jitter
+        return random.uniform(0, min(self.max_backoff,
+                                     self.backoff * 2 ** attempt))
+
+    # Call send() until it returns a response which should not be retried
+    # or until retries are exhausted, return the last response. With a
+    # deadline.Deadline, no retry is made if its delay would exceed it
+    def run(self, send, method='GET', deadline=None):
+        attempt = 0
+        while True:
+            if deadline is not None:
+                deadline.check()
+            if self.bucket is not None:
+                self.bucket.acquire(deadline)
+            response = send()
+            if attempt >= self.retries or \
+               not self.should_retry(method, response):
+                return response
+            delay = self.delay(attempt, response)
+            if deadline is not None and delay >= deadline.remaining():
+                return response
+            logging.debug("%s %s [%s], retrying in %.2fs" %
+                          (str(method).upper(), response.url,
+                           response.status_code, delay))
+            # give the connection of a streamed response back to the pool
+            response.close()
+            time.sleep(delay)
+            attempt += 1
+
+# vim:set shiftwidth=4 tabstop=4 softtabstop=4 encoding=utf-8 expandtab textwidth=79
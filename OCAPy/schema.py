@@ -17,19 +17,30 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 
+import gzip
+import json
+import marshal
+import os
+import re
+import time
+from contextlib import closing
+
 import requests
+import batch
 from errors import OCAPyException
+from session import SessionPool
 
 class Schemas(object):
     """A set of Schema"""
 
-    def __init__(self, base_url=None):
+    def __init__(self, base_url=None, session=None):
         self.base_url = base_url
+        self.session = session
         self.list = []
 
     def retrieve(self, format='json'):
         """retrieves all the schemas URL"""
-        request = requests.get(self.base_url)
+        request = (self.session or requests).get(self.base_url)
 
         if request.status_code != requests.codes.ok:
             raise OCAPyException('Unable to retrieve JSON schemas: %s' % 
@@ -39,31 +50,223 @@ class Schemas(object):
             self.list.append(Schema(base_url=self.base_url,
                                     path=str(api['schema']).format(path=api['path'],
                                     format=format),
-                                    format=format))
+                                    format=format,
+                                    session=self.session))
         return self.list
 
     
 class Schema(object):
     """modelizes a schema"""
 
-    def __init__(self, base_url=None, path=None, format='json'):
+    def __init__(self, base_url=None, path=None, format='json', session=None):
         self.base_url = base_url
         self.path = path
         self.format = format
+        self.session = session
         self.content = None
+        self.etag = None
+        self.last_modified = None
 
+    # When the schema has already been loaded, it is only downloaded again if
+    # it changed since (ETag/Last-Modified revalidation)
     def load(self):
         url = '%s/%s' % (self.base_url.rstrip('/'), self.path.lstrip('/'))
-        request = requests.get(url)
+        headers = {}
+        if self.content is not None:
+            if self.etag:
+                headers['If-None-Match'] = self.etag
+            if self.last_modified:
+                headers['If-Modified-Since'] = self.last_modified
+        request = (self.session or requests).get(url, headers=headers)
+
+        if request.status_code == requests.codes.not_modified:
+            return self.content
 
         if request.status_code != requests.codes.ok:
             raise OCAPyException('Unable to load JSON schema %s: %s' %
                                  (self.path, request.json()['message']), request=request)
 
         self.content = request.json()
+        self.etag = request.headers.get('ETag')
+        self.last_modified = request.headers.get('Last-Modified')
         return self.content
 
 
+
+class SchemaStore(object):
+    """All the schemas of an API, saved on disk with an index of their
+    operations
+
+    update() downloads the schemas (concurrently, and only the ones which
+    changed since the last update) and saves them, load() reads the index
+    saved by the last update. The index maps each path template
+    (/dedicated/server/{serviceName}) and HTTP method to its operation
+    definition.
+    """
+
+    def __init__(self, base_url=None, directory=None, session=None,
+                 max_workers=batch.MAX_WORKERS):
+        self.base_url = base_url
+        self.directory = directory or '%s/.ocapy/schemas/%s' % (
+            os.path.expanduser('~'),
+            re.sub('[^A-Za-z0-9.]+', '_', str(base_url)).strip('_'))
+        self.session = session or SessionPool(pool_maxsize=max_workers)
+        self.max_workers = max_workers
+        self.operations = {}
+        self.models = {}
+        self.updated = None
+        self.tree = None
+
+    @property
+    def index_file(self):
+        return os.path.join(self.directory, 'index')
+
+    @property
+    def schemas_file(self):
+        return os.path.join(self.directory, 'schemas.json.gz')
+
+    # Load the saved index, return False if there is none
+    def load(self):
+        try:
+            with open(self.index_file, 'rb') as f:
+                index = marshal.load(f)
+        except (IOError, EOFError, ValueError, TypeError):
+            return False
+        self.operations = index['operations']
+        self.models = index['models']
+        self.updated = index['updated']
+        self.tree = None
+        return True
+
+    # Load the saved index, or update it if there is none
+    def ensure(self):
+        if not self.load():
+            self.update()
+        return self
+
+    # Download the schemas which changed since the last update, save them and
+    # their index
+    def update(self):
+        saved = self._read_schemas()
+        schemas = Schemas(base_url=self.base_url, session=self.session)
+        for schema in schemas.retrieve():
+            previous = saved.get(schema.path)
+            if previous is not None:
+                schema.content = previous['content']
+                schema.etag = previous['etag']
+                schema.last_modified = previous['last_modified']
+
+        for result in batch.imap(lambda schema: schema.load(), schemas.list,
+                                 max_workers=self.max_workers):
+            if not result.ok:
+                raise result.error
+
+        operations = {}
+        models = {}
+        for schema in schemas.list:
+            models.update(schema.content.get('models') or {})
+            for api in schema.content.get('apis') or []:
+                methods = operations.setdefault(api['path'], {})
+                for operation in api.get('operations') or []:
+                    methods[str(operation['httpMethod']).upper()] = operation
+
+        self.operations = operations
+        self.models = models
+        self.updated = time.time()
+        self.tree = None
+        self._save(schemas.list)
+        return self
+
+    # Return the operation of a path template or None
+    def operation(self, template, method='GET'):
+        return self.operations.get(template, {}).get(str(method).upper())
+
+    def templates(self):
+        return sorted(self.operations.keys())
+
+    # Return the path template matching path and its operation for method,
+    # (None, None) if no template matches:
+    # /dedicated/server/ns1.ovh.net => /dedicated/server/{serviceName}
+    def match(self, path, method='GET'):
+        if self.tree is None:
+            self.tree = self._build_tree()
+        segments = [segment for segment in path.split('?')[0].split('/')
+                    if segment]
+        template = self._match(self.tree, segments)
+        if template is None:
+            return None, None
+        return template, self.operation(template, method)
+
+    # Return the segments tree node of path, None if no template starts with
+    # path. Fixed segments are preferred, without going back on a dead end.
+    def node(self, path):
+        if self.tree is None:
+            self.tree = self._build_tree()
+        node = self.tree
+        for segment in path.split('/'):
+            if not segment:
+                continue
+            node = node.get(segment, node.get('*'))
+            if node is None:
+                return None
+        return node
+
+    # Segments tree of the templates, variable segments are stored as '*'
+    # and the template of a node as ''
+    def _build_tree(self):
+        tree = {}
+        for template in self.operations:
+            node = tree
+            for segment in template.split('/'):
+                if not segment:
+                    continue
+                if segment.startswith('{'):
+                    segment = '*'
+                node = node.setdefault(segment, {})
+            node[''] = template
+        return tree
+
+    # Fixed segments are preferred to variable ones
+    def _match(self, node, segments):
+        if not segments:
+            return node.get('')
+        for key in (segments[0], '*'):
+            child = node.get(key)
+            if child is not None:
+                template = self._match(child, segments[1:])
+                if template is not None:
+                    return template
+        return None
+
+    def _read_schemas(self):
+        try:
+            with closing(gzip.open(self.schemas_file, 'rb')) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    # Files are written then renamed so a reader never sees a partial file
+    def _save(self, schemas):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        content = dict((schema.path, {'etag': schema.etag,
+                                      'last_modified': schema.last_modified,
+                                      'content': schema.content})
+                       for schema in schemas)
+        tmp = '%s.tmp' % self.schemas_file
+        with closing(gzip.open(tmp, 'wb')) as f:
+            json.dump(content, f, separators=(',', ':'))
+        os.rename(tmp, self.schemas_file)
+
+        tmp = '%s.tmp' % self.index_file
+        with open(tmp, 'wb') as f:
+            marshal.dump({'operations': self.operations,
+                          'models': self.models,
+                          'updated': self.updated}, f, 2)
+        os.rename(tmp, self.index_file)
+
+
 if __name__ == '__main__':
     schemas = Schemas()
     schemas.base_url = 'https://api.ovh.com/1.0/'
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Pierre-Samuel Le Stang (ps@lestang.fr)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+class SessionPool(object):
+    """A pool of persistent HTTP connections
+
+    Each thread gets its own requests.Session, all the sessions share the
+    same adapter so the connections are kept alive and re-used across
+    requests and threads. The pool can be used wherever the requests module
+    is expected: pool.get(url), pool.request('GET', url), ...
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, max_retries=0,
+                 keep_alive=True, adapter=None):
+        self.keep_alive = keep_alive
+        self.adapter = adapter or HTTPAdapter(pool_connections=pool_connections,
+                                              pool_maxsize=pool_maxsize,
+                                              max_retries=max_retries)
+        self.local = threading.local()
+
+    # Return the session of the current thread
+    @property
+    def session(self):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', self.adapter)
+            session.mount('https://', self.adapter)
+            if not self.keep_alive:
+                session.headers['Connection'] = 'close'
+            self.local.session = session
+        return session
+
+    def request(self, method, url, **kwargs):
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    # Close all the pooled connections
+    def close(self):
+        self.adapter.close()
+
+# vim:set shiftwidth=4 tabstop=4 softtabstop=4 encoding=utf-8 expandtab textwidth=79
@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Pierre-Samuel Le Stang (ps@lestang.fr)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. module:: shell
+    :platform: Unix
+    :synopsis: Interactive OCAPy shell
+
+.. moduleauthor:: Pierre-Samuel Le Stang <ps@lestang.fr>
+
+The API is browsed like a file system::
+
+    ocapy:/> cd /dedicated/server
+    ocapy:/dedicated/server> ls
+    ocapy:/dedicated/server> get ns1234.ovh.net/ips
+    ocapy:/dedicated/server> post ns1234.ovh.net/reboot
+
+Paths and parameters are completed with the tab key from the schemas saved
+by :class:`SchemaStore`, completion never waits for the network. The ids of
+the list resources met while completing are fetched in the background and
+completed once they are received.
+"""
+
+import cmd
+import json
+import logging
+import posixpath
+import shlex
+import threading
+import urllib
+from multiprocessing.pool import ThreadPool
+
+from schema import SchemaStore
+
+# Number of list resources fetched at the same time in the background
+PREFETCH_WORKERS = 4
+
+
+class Prefetcher(object):
+    """GETs resources in the background and keeps their responses"""
+
+    def __init__(self, workers=PREFETCH_WORKERS):
+        self.pool = ThreadPool(processes=workers)
+        self.results = {}
+        self.lock = threading.Lock()
+
+    # GET resource in the background unless it is already done
+    def prefetch(self, path, resource):
+        with self.lock:
+            if path not in self.results:
+                self.results[path] = self.pool.apply_async(resource.get)
+
+    # Return the response of path, None if it is not received yet (waiting
+    # at most timeout seconds) or if the request failed
+    def get(self, path, timeout=0):
+        result = self.results.get(path)
+        if result is None:
+            return None
+        if timeout:
+            result.wait(timeout)
+        if not result.ready() or not result.successful():
+            return None
+        return result.get()
+
+    # Forget the response of path and of its sub paths
+    def forget(self, path):
+        with self.lock:
+            for key in list(self.results):
+                if key == path or key.startswith(path.rstrip('/') + '/'):
+                    del self.results[key]
+
+    def close(self):
+        self.pool.terminate()
+
+
+class Shell(cmd.Cmd):
+    """Interactive shell on an OCAPy instance"""
+
+    intro = 'OCAPy shell, type help or ? to list the commands.'
+
+    def __init__(self, api, store=None, prefetcher=None):
+        cmd.Cmd.__init__(self)
+        self.api = api
+        self.store = store or SchemaStore(base_url=api.base_url)
+        self.prefetcher = prefetcher or Prefetcher()
+        self.cwd = '/'
+        self.prompt = 'ocapy:/> '
+        # the schemas are downloaded in the background if they are not saved
+        self.updating = None
+        if not self.store.load():
+            self.update()
+
+    # Paths
+
+    # Absolute and normalized path of path relative to the current one
+    def absolute(self, path):
+        path = posixpath.normpath(posixpath.join(self.cwd, path or '.'))
+        return '/' + path.strip('/')
+
+    # Return the resource of an absolute path, the segments which are not in
+    # the schemas are call arguments: /dedicated/server/ns1.ovh.net is
+    # api.dedicated.server('ns1.ovh.net')
+    def resource(self, path):
+        resource = self.api
+        node = self.store.node('/')
+        for segment in path.split('/'):
+            if not segment:
+                continue
+            child = node.get(segment) if node is not None else None
+            if resource is self.api:
+                resource = getattr(resource, segment)
+                node = child
+            elif child is not None:
+                # a segment may be called like a Resource attribute (api,
+                # get...)
+                resource = resource._child(segment)
+                node = child
+            else:
+                resource = resource(urllib.unquote_plus(segment))
+                node = node.get('*') if node is not None else None
+        return resource
+
+    # GET in the background the list of the ids of the variable segment
+    # following path, return False if path is not a list resource
+    def prefetch(self, path):
+        node = self.store.node(path)
+        if node is None or '*' not in node or '' not in node:
+            return False
+        if self.store.operation(node[''], 'GET') is None:
+            return False
+        self.prefetcher.prefetch(path, self.resource(path))
+        return True
+
+    # Return the names of the next segments of path known without waiting:
+    # the fixed ones from the schemas and the prefetched ids
+    def segments(self, path):
+        node = self.store.node(path)
+        if node is None:
+            return []
+        # readline wants str
+        names = [(key.encode('utf-8'), branch(child))
+                 for key, child in node.items() if key not in ('', '*')]
+        if '*' in node:
+            self.prefetch(path)
+            ids = self.prefetcher.get(path)
+            if isinstance(ids, list):
+                more = branch(node['*'])
+                names.extend((urllib.quote_plus(unicode(id).encode('utf-8')),
+                              more) for id in ids)
+        return sorted(names)
+
+    def complete_path(self, text):
+        if '/' in text:
+            directory, prefix = text.rsplit('/', 1)
+            directory += '/'
+        else:
+            directory, prefix = '', text
+        path = self.absolute(directory)
+        completions = [directory + name + ('/' if more else '')
+                       for name, more in self.segments(path)
+                       if name.startswith(prefix)]
+        # the ids under a single completion are fetched for the next tab
+        if len(completions) == 1:
+            self.prefetch(self.absolute(completions[0]))
+        return completions
+
+    # Complete the parameters names of the operation method of path
+    def complete_parameters(self, text, path, method):
+        template, operation = self.store.match(path, method)
+        if operation is None:
+            return []
+        return ['%s=' % parameter['name'].encode('utf-8')
+                for parameter in operation.get('parameters') or []
+                if parameter.get('paramType') != 'path'
+                and parameter['name'].startswith(text)]
+
+    # Complete the path, then the parameters of a request command
+    def complete_request(self, text, line, begidx, method=None):
+        words = line[:begidx].split()
+        if len(words) <= 1:
+            return self.complete_path(text)
+        if method is None:
+            return []
+        return self.complete_parameters(text, self.absolute(words[1]), method)
+
+    def complete_cd(self, text, line, begidx, endidx):
+        return self.complete_request(text, line, begidx)
+
+    complete_ls = complete_cd
+    complete_describe = complete_cd
+
+    def complete_get(self, text, line, begidx, endidx):
+        return self.complete_request(text, line, begidx, 'GET')
+
+    def complete_post(self, text, line, begidx, endidx):
+        return self.complete_request(text, line, begidx, 'POST')
+
+    def complete_put(self, text, line, begidx, endidx):
+        return self.complete_request(text, line, begidx, 'PUT')
+
+    def complete_delete(self, text, line, begidx, endidx):
+        return self.complete_request(text, line, begidx, 'DELETE')
+
+    def completenames(self, text, *ignored):
+        return [name + ' ' for name in cmd.Cmd.completenames(self, text)]
+
+    # Commands
+
+    def emptyline(self):
+        pass
+
+    def default(self, line):
+        print 'Unknown command: %s' % line.split()[0]
+
+    def postcmd(self, stop, line):
+        self.prompt = 'ocapy:%s> ' % self.cwd
+        return stop
+
+    def do_cd(self, line):
+        """cd PATH: change the current path"""
+        path = self.absolute(line.strip() or '/')
+        if self.store.node(path) is None:
+            print 'Unknown path: %s' % path
+            return
+        self.cwd = path
+        self.prefetch(path)
+
+    def do_ls(self, line):
+        """ls [PATH]: list the sub paths, and the ids of a list resource"""
+        path = self.absolute(line.strip())
+        node = self.store.node(path)
+        if node is None:
+            print 'Unknown path: %s' % path
+            return
+        if self.prefetch(path) and \
+           self.prefetcher.get(path, timeout=30) is None:
+            print 'Could not list %s' % path
+        for name, more in self.segments(path):
+            print name + ('/' if more else '')
+
+    def do_pwd(self, line):
+        """pwd: print the current path"""
+        print self.cwd
+
+    def do_get(self, line):
+        """get PATH [name=value ...]: GET a resource with query parameters"""
+        self.request('GET', line)
+
+    def do_post(self, line):
+        """post PATH [name=value ...]: POST a body to a resource"""
+        self.request('POST', line)
+
+    def do_put(self, line):
+        """put PATH [name=value ...]: PUT a body to a resource"""
+        self.request('PUT', line)
+
+    def do_delete(self, line):
+        """delete PATH: DELETE a resource"""
+        self.request('DELETE', line)
+
+    def do_describe(self, line):
+        """describe [PATH]: print the operations of a path"""
+        path = self.absolute(line.strip())
+        template, operation = self.store.match(path)
+        if template is None:
+            print 'Unknown path: %s' % path
+            return
+        print template
+        for method, operation in sorted(self.store.operations[template]
+                                        .items()):
+            print '  %s %s' % (method, operation.get('description') or '')
+            for parameter in operation.get('parameters') or []:
+                print '    %s%s (%s, %s)' % (
+                    parameter['name'],
+                    '' if parameter.get('required') else '?',
+                    parameter.get('dataType'), parameter.get('paramType'))
+
+    def do_update(self, line):
+        """update: download the schemas which changed"""
+        self.update()
+
+    def do_exit(self, line):
+        """exit: leave the shell"""
+        self.prefetcher.close()
+        return True
+
+    do_quit = do_exit
+    do_EOF = do_exit
+
+    # Run a request and print its response
+    def request(self, method, line):
+        try:
+            words = shlex.split(line)
+        except ValueError as e:
+            print e
+            return
+        path = self.absolute(words[0] if words else '')
+        # the root is the API itself, not a resource
+        if path == '/':
+            print 'Unknown path: %s' % path
+            return
+        arguments = {}
+        for word in words[1:]:
+            name, _, value = word.partition('=')
+            arguments[name] = value
+        kwargs = {}
+        if method == 'GET':
+            if arguments:
+                kwargs['params'] = arguments
+        elif arguments:
+            kwargs['data'] = dict((name, decode(value))
+                                  for name, value in arguments.items())
+        try:
+            value = getattr(self.resource(path), method.lower())(**kwargs)
+        except Exception as e:
+            print e
+            return
+        if method != 'GET':
+            self.prefetcher.forget(path)
+        print json.dumps(value, indent=2, sort_keys=True)
+
+    # Download the schemas in the background
+    def update(self):
+        if self.updating is not None and self.updating.is_alive():
+            print 'Schemas are being updated'
+            return
+        print 'Updating the schemas in the background...'
+        self.updating = threading.Thread(target=self._update)
+        self.updating.daemon = True
+        self.updating.start()
+
+    def _update(self):
+        try:
+            self.store.update()
+        except Exception as e:
+            logging.error('Schemas update failed: %s' % e)
+
+    def run(self):
+        try:
+            import readline
+            # paths are completed as a whole
+            readline.set_completer_delims(' \t\n')
+        except ImportError:
+            pass
+        self.cmdloop()
+
+
+# Tell if a segments tree node has sub nodes
+def branch(node):
+    return len(node) > 1 or '' not in node
+
+# A body value is JSON if it can be decoded, a string otherwise
+def decode(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+# vim:set shiftwidth=4 tabstop=4 softtabstop=4 encoding=utf-8 expandtab textwidth=79
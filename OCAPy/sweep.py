@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Pierre-Samuel Le Stang (ps@lestang.fr)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. module:: sweep
+    :platform: Unix
+    :synopsis: Queries run on several profiles at once
+
+.. moduleauthor:: Pierre-Samuel Le Stang <ps@lestang.fr>
+
+A :class:`Sweep` runs the same query on all the configured profiles, or on
+some of them, concurrently. The results are yielded as soon as they are
+received, as :class:`batch.Result` whose key is the profile name::
+
+    sweep = Sweep()
+    for result in sweep.get('/dedicated/server'):
+        print result.key, result.value if result.ok else result.error
+
+    for result in sweep.run(lambda api: api.me.bill.get(params={'date.from':
+                                                                '2013-01-01'})):
+        ...
+
+"""
+
+import batch
+from OCAPy import OCAPy
+from config import Config
+from errors import OCAPyException
+from ratelimit import Scheduler
+
+# Default number of profiles queried at the same time
+MAX_WORKERS = 32
+
+
+class Sweep(object):
+    """Runs queries on several profiles at once
+
+    Each profile has its own OCAPy instance, built on first use and kept
+    for the next queries: its own connections, and its own rate limit when
+    rate_limit is set. kwargs are given to each OCAPy instance.
+    """
+
+    def __init__(self, profiles=None, config=None, max_workers=MAX_WORKERS,
+                 rate_limit=None, burst=None, **kwargs):
+        self.config = config or Config.cached()
+        names = profiles
+        if names is None:
+            names = [profile.name for profile in self.config.profiles]
+        self.profiles = []
+        for name in names:
+            profile = self.config.profile(name)
+            if profile is None:
+                raise OCAPyException('OCAPy profile "%s" is unknown' % name)
+            self.profiles.append(profile)
+        self.max_workers = max_workers
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.kwargs = kwargs
+        self.apis = {}
+
+    # Return the OCAPy instance of profile
+    def api(self, profile):
+        api = self.apis.get(profile.name)
+        if api is None:
+            kwargs = dict(self.kwargs)
+            # the rate budget of a profile is not shared with the others
+            kwargs.setdefault('scheduler', Scheduler(
+                rate=self.rate_limit, burst=self.burst,
+                key=(profile.base_url, profile.app_key, profile.consumer_key)))
+            api = OCAPy(base_url=profile.base_url, app_key=profile.app_key,
+                        app_secret=profile.app_secret,
+                        consumer_key=profile.consumer_key, **kwargs)
+            self.apis[profile.name] = api
+        return api
+
+    # Call query with the OCAPy instance of each profile, yield a
+    # batch.Result per profile as soon as it is done
+    def run(self, query):
+        call = lambda profile: query(self.api(profile))
+        for result in batch.as_completed(call, self.profiles,
+                                         max_workers=self.max_workers):
+            result.key = result.key.name
+            yield result
+
+    # GET path on each profile: sweep.get('/me/bill', params={...})
+    def get(self, path, **kwargs):
+        return self.run(lambda api: resource(api, path).get(**kwargs))
+
+    # Same as run but return a dict profile name => batch.Result
+    def collect(self, query):
+        return dict((result.key, result) for result in self.run(query))
+
+    def close(self):
+        for api in self.apis.values():
+            api.sessions.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+        return False
+
+
+# Return the resource of path: /dedicated/server is api.dedicated.server
+def resource(api, path):
+    resource = api
+    for segment in path.split('/'):
+        if not segment:
+            continue
+        if resource is api:
+            resource = getattr(resource, segment)
+        else:
+            # a segment may be called like a Resource attribute (api, get...)
+            resource = resource._child(segment)
+    return resource
+
+# vim:set shiftwidth=4 tabstop=4 softtabstop=4 encoding=utf-8 expandtab textwidth=79
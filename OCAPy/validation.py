@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Pierre-Samuel Le Stang (ps@lestang.fr)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. module:: validation
+    :platform: Unix
+    :synopsis: Client side validation of the requests
+
+.. moduleauthor:: Pierre-Samuel Le Stang <ps@lestang.fr>
+
+The operations of a :class:`schema.SchemaStore` are compiled once into
+:class:`Validator` instances which check the query parameters and the body
+of a request before it is sent::
+
+    store = SchemaStore(base_url='https://api.ovh.com/1.0/').ensure()
+    ocapy = OCAPy(ocapy_profile='default', validate=store)
+    # raises OCAPyValidationException, no request is sent
+    ocapy.me.bill.get(params={'orderid': 12})
+
+"""
+
+import re
+import threading
+from collections import OrderedDict
+
+from errors import OCAPyValidationException
+
+INTEGER = re.compile(r'^-?\d+$')
+
+# Maximum number of paths whose template is remembered
+TEMPLATES_SIZE = 4096
+
+def is_string(value, query=False):
+    return isinstance(value, basestring)
+
+def is_integer(value, query=False):
+    if query and isinstance(value, basestring):
+        return INTEGER.match(value) is not None
+    return isinstance(value, (int, long)) and not isinstance(value, bool)
+
+def is_number(value, query=False):
+    if query and isinstance(value, basestring):
+        try:
+            float(value)
+            return True
+        except ValueError:
+            return False
+    return isinstance(value, (int, long, float)) and not isinstance(value, bool)
+
+def is_boolean(value, query=False):
+    if query and isinstance(value, basestring):
+        return value in ('true', 'false')
+    return isinstance(value, bool)
+
+def is_any(value, query=False):
+    return True
+
+# OVH data types which are not strings, the others (ipv4, datetime,
+# phoneNumber, ...) are sent as strings
+TYPES = {
+    'long': is_integer,
+    'int': is_integer,
+    'double': is_number,
+    'float': is_number,
+    'boolean': is_boolean,
+}
+
+# Compile the check of an OVH data type, a check returns an error message or
+# None
+def compile_type(data_type, models, depth=0):
+    data_type = str(data_type or '')
+    if data_type.endswith('[]'):
+        check_item = compile_type(data_type[:-2], models, depth)
+        def check_list(value, query=False):
+            if query and not isinstance(value, (list, tuple)):
+                value = [value]
+            if not isinstance(value, (list, tuple)):
+                return 'is not a list'
+            for item in value:
+                error = check_item(item, query)
+                if error is not None:
+                    return error
+        return check_list
+
+    if data_type.startswith('map['):
+        def check_map(value, query=False):
+            if not isinstance(value, dict):
+                return 'is not a map'
+        return check_map
+
+    model = models.get(data_type)
+    if model is not None and 'enum' in model:
+        values = frozenset(model['enum'])
+        def check_enum(value, query=False):
+            if value not in values:
+                return 'is not one of %s' % ', '.join(sorted(values))
+        return check_enum
+
+    if model is not None and 'properties' in model and depth < 2:
+        properties = compile_properties(model['properties'], models, depth + 1)
+        def check_model(value, query=False):
+            if not isinstance(value, dict):
+                return 'is not a %s object' % data_type
+            for name, item in value.iteritems():
+                check = properties.get(name)
+                if check is None:
+                    return 'has an unknown property %s' % name
+                if item is not None:
+                    error = check(item, query)
+                    if error is not None:
+                        return 'property %s %s' % (name, error)
+        return check_model
+
+    check = TYPES.get(data_type)
+    if check is None:
+        # the other primitive types are sent as strings, models are not
+        # checked
+        if model is None and data_type not in ('', 'void') and \
+           '.' not in data_type:
+            check = is_string
+        else:
+            check = is_any
+    def check_type(value, query=False):
+        if not check(value, query):
+            return 'is not a %s' % data_type
+    return check_type
+
+def compile_properties(properties, models, depth=0):
+    return dict((name, compile_type(definition.get('type'), models, depth))
+                for name, definition in properties.iteritems())
+
+
+class Validator(object):
+    """Checks the query parameters and the body of an operation"""
+
+    def __init__(self, template=None, operation=None, models=None):
+        self.template = template
+        self.method = str(operation.get('httpMethod', '')).upper()
+        self.query = {}
+        self.body = {}
+        self.required_query = []
+        self.required_body = []
+        self.body_type = None
+        models = models or {}
+
+        for parameter in operation.get('parameters') or []:
+            name = parameter.get('name')
+            check = compile_type(parameter.get('dataType'), models)
+            required = bool(parameter.get('required'))
+            kind = parameter.get('paramType')
+            if kind == 'query':
+                self.query[name] = check
+                if required:
+                    self.required_query.append(name)
+            elif kind == 'body' and not name:
+                # the whole body is a model
+                self.body_type = check
+            elif kind == 'body':
+                self.body[name] = check
+                if required:
+                    self.required_body.append(name)
+
+    def fail(self, message):
+        raise OCAPyValidationException('%s %s: %s' % (self.method,
+                                                      self.template, message))
+
+    # Raise an OCAPyValidationException if params or data are not valid
+    def validate(self, params=None, data=None):
+        params = params or {}
+        for name in self.required_query:
+            if name not in params:
+                self.fail('missing parameter %s' % name)
+        for name, value in params.iteritems():
+            check = self.query.get(name)
+            if check is None:
+                self.fail('unknown parameter %s' % name)
+            error = check(value, True)
+            if error is not None:
+                self.fail('parameter %s %s' % (name, error))
+
+        if self.body_type is not None:
+            if data is not None:
+                error = self.body_type(data)
+                if error is not None:
+                    self.fail('body %s' % error)
+            return
+
+        if data is None:
+            data = {}
+        elif not isinstance(data, dict):
+            self.fail('body is not an object')
+        for name in self.required_body:
+            if name not in data:
+                self.fail('missing body property %s' % name)
+        for name, value in data.iteritems():
+            check = self.body.get(name)
+            if check is None:
+                self.fail('unknown body property %s' % name)
+            if value is not None:
+                error = check(value)
+                if error is not None:
+                    self.fail('body property %s %s' % (name, error))
+
+
+class Validators(object):
+    """Validators of the operations of a SchemaStore, compiled on first use
+    and cached per path template and method"""
+
+    def __init__(self, store=None):
+        self.store = store
+        # (template, method) => Validator, None if the method is not allowed
+        self.validators = {}
+        # least recently used paths => template
+        self.templates = OrderedDict()
+        self.lock = threading.Lock()
+
+    # Return the template of a path, None if it is unknown
+    def template(self, path):
+        with self.lock:
+            if path in self.templates:
+                template = self.templates.pop(path)
+                self.templates[path] = template
+                return template
+        template, operation = self.store.match(path)
+        with self.lock:
+            self.templates[path] = template
+            if len(self.templates) > TEMPLATES_SIZE:
+                self.templates.popitem(last=False)
+        return template
+
+    # Return the validator of a request, None if its path is unknown
+    def get(self, path, method='GET'):
+        method = str(method).upper()
+        template = self.template(path)
+        if template is None:
+            return None
+        key = (template, method)
+        try:
+            validator = self.validators[key]
+        except KeyError:
+            operation = self.store.operation(template, method)
+            validator = None
+            if operation is not None:
+                validator = Validator(template=template, operation=operation,
+                                      models=self.store.models)
+            with self.lock:
+                self.validators[key] = validator
+        if validator is None:
+            raise OCAPyValidationException('%s %s: method not allowed' %
+                                           (method, template))
+        return validator
+
+    def validate(self, path, method='GET', params=None, data=None):
+        validator = self.get(path, method)
+        if validator is not None:
+            validator.validate(params=params, data=data)
+
+# vim:set shiftwidth=4 tabstop=4 softtabstop=4 encoding=utf-8 expandtab textwidth=79
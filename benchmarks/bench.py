@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Pierre-Samuel Le Stang (ps@lestang.fr)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. module:: bench
+    :platform: Unix
+    :synopsis: OCAPy benchmarks against a local mock API
+
+.. moduleauthor:: Pierre-Samuel Le Stang <ps@lestang.fr>
+
+Each scenario drives OCAPy through a number of logical calls and reports
+the throughput, the p50/p99 latency of a logical call and the number of
+HTTP requests received by the mock API per logical call::
+
+    python benchmarks/bench.py --latency 0.005 --calls 500
+    python benchmarks/bench.py --scenario fanout --workers 20 --json
+    python benchmarks/bench.py -s items -s hedged --latency 0.02 --stall 2
+
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+import logging
+logging.basicConfig(level=logging.WARNING)
+
+from OCAPy import OCAPy
+from mockapi import MockAPIProcess, APP_KEY, APP_SECRET, CONSUMER_KEY
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q * (len(values) - 1))))
+    return values[index]
+
+# Time each call of function(i) for i in range(calls), return the list of
+# durations
+def timed(function, calls):
+    durations = []
+    for i in range(calls):
+        started = time.time()
+        function(i)
+        durations.append(time.time() - started)
+    return durations
+
+
+# Scenarios: each one takes the api, the server and the options and returns
+# the list of the logical calls durations
+
+def sequential_get(api, server, options):
+    return timed(lambda i: api.me.get(), options.calls)
+
+def fanout(api, server, options):
+    ids = api.items.get()
+    server.reset()
+    def fetch(i):
+        for result in api.items.get_many(ids, max_workers=options.workers):
+            if not result.ok:
+                raise result.error
+    return timed(fetch, max(1, options.calls / len(ids)))
+
+# GETs of the items one after the other, hedged or not: with --stall, the
+# stalled ones make the p99 of the items scenario
+def items_get(api, server, options, hedge=False):
+    ids = api.items.get()
+    server.reset()
+    return timed(lambda i: api.items(ids[i % len(ids)]).get(hedge=hedge),
+                 options.calls)
+
+def hedged_get(api, server, options):
+    return items_get(api, server, options, hedge=True)
+
+def large_list(api, server, options):
+    return timed(lambda i: api.big.get(), max(1, options.calls / 50))
+
+def post_body(api, server, options):
+    body = {'description': 'benchmark', 'values': range(50)}
+    return timed(lambda i: api.items.post(data=body), options.calls)
+
+SCENARIOS = [
+    ('sequential', sequential_get),
+    ('fanout', fanout),
+    ('items', items_get),
+    ('hedged', hedged_get),
+    ('large', large_list),
+    ('post', post_body),
+]
+
+
+def run(name, scenario, options):
+    server = MockAPIProcess(latency=options.latency,
+                            list_size=options.list_size,
+                            large_size=options.large_size,
+                            stall=options.stall,
+                            stall_every=options.stall_every).start()
+    try:
+        api = OCAPy(base_url=server.base_url, app_key=APP_KEY,
+                    app_secret=APP_SECRET, consumer_key=CONSUMER_KEY,
+                    pool_maxsize=max(10, options.workers))
+        # warm up: time synchronisation and connections
+        api.me.get()
+        server.reset()
+
+        started = time.time()
+        durations = scenario(api, server, options)
+        elapsed = time.time() - started
+        # let the attempts left behind by the hedged calls end
+        time.sleep(options.stall)
+        api.sessions.close()
+        requests = server.requests()
+        time_requests = server.requests('/auth/time')
+    finally:
+        server.stop()
+
+    calls = len(durations)
+    return {
+        'scenario': name,
+        'calls': calls,
+        'elapsed': elapsed,
+        'throughput': calls / elapsed if elapsed else None,
+        'p50': percentile(durations, 0.50),
+        'p99': percentile(durations, 0.99),
+        'requests': requests,
+        'requests_per_call': float(requests) / calls,
+        'time_requests': time_requests,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='bench', description='OCAPy '
+                                     'benchmarks against a local mock API')
+    parser.add_argument('-s', '--scenario', action='append',
+                        choices=[name for name, _ in SCENARIOS],
+                        help='Scenario to run, default is to run them all')
+    parser.add_argument('-n', '--calls', type=int, default=200,
+                        help='Number of logical calls per scenario')
+    parser.add_argument('-l', '--latency', type=float, default=0.0,
+                        help='Latency of the mock API, in seconds')
+    parser.add_argument('-w', '--workers', type=int, default=10,
+                        help='Number of workers of the fan-out scenario')
+    parser.add_argument('--list-size', type=int, default=100,
+                        help='Number of items of the fan-out list')
+    parser.add_argument('--large-size', type=int, default=10000,
+                        help='Number of objects of the large list')
+    parser.add_argument('--stall', type=float, default=0.0,
+                        help='Delay of the stalled item GETs, in seconds')
+    parser.add_argument('--stall-every', type=int, default=50,
+                        help='One item GET out of this number is stalled')
+    parser.add_argument('-j', '--json', action='store_true',
+                        help='Output the results as JSON lines')
+    options = parser.parse_args(argv)
+
+    selected = options.scenario or [name for name, _ in SCENARIOS]
+    if not options.json:
+        print '%-12s %8s %10s %10s %10s %10s %8s' % (
+            'scenario', 'calls', 'calls/s', 'p50 (ms)', 'p99 (ms)',
+            'req/call', 'time req')
+    for name, scenario in SCENARIOS:
+        if name not in selected:
+            continue
+        result = run(name, scenario, options)
+        if options.json:
+            print json.dumps(result)
+        else:
+            print '%-12s %8d %10.1f %10.2f %10.2f %10.2f %8d' % (
+                name, result['calls'], result['throughput'],
+                result['p50'] * 1000, result['p99'] * 1000,
+                result['requests_per_call'], result['time_requests'])
+
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 tabstop=4 softtabstop=4 encoding=utf-8 expandtab textwidth=79
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Pierre-Samuel Le Stang (ps@lestang.fr)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+.. module:: mockapi
+    :platform: Unix
+    :synopsis: Local stand-in of the OVH API for benchmarks
+
+.. moduleauthor:: Pierre-Samuel Le Stang <ps@lestang.fr>
+
+The server answers /auth/time, checks the signature of the other requests
+and serves JSON resources after a configurable latency:
+
+* GET /me: an object
+* GET /items: the list of the items ids
+* GET /items/{id}: an item, every stall_every one after stall seconds
+* POST /items: echoes the body
+* GET /big: a list of large_size objects
+
+GET /_counts returns the number of requests received per method and path,
+DELETE /_counts resets them.
+
+"""
+
+import BaseHTTPServer
+import SocketServer
+import hashlib
+import json
+import multiprocessing
+import threading
+import time
+import urlparse
+
+import requests
+
+APP_KEY = 'benchkey'
+APP_SECRET = 'benchsecret'
+CONSUMER_KEY = 'benchconsumer'
+
+# Drift between the server and local time, in seconds
+DRIFT = 42
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Handles the requests of a MockAPI"""
+
+    protocol_version = 'HTTP/1.1'
+    # write each response at once, without waiting for delayed ACKs
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body):
+        content = json.dumps(body) if not isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def handle_method(self, method):
+        server = self.server
+        url = urlparse.urlparse(self.path)
+        path = url.path[len(server.prefix):] or '/'
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else ''
+        if path == '/_counts':
+            if method == 'DELETE':
+                server.reset()
+            return self.reply(200, server.counts)
+
+        server.count(method, path)
+
+        if path == '/auth/time':
+            return self.reply(200, str(int(time.time()) + DRIFT))
+
+        error = self.check_signature(method, body)
+        if error is not None:
+            return self.reply(400, error)
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        segments = [segment for segment in path.split('/') if segment]
+        if segments == ['me']:
+            return self.reply(200, server.me)
+        if segments == ['items'] and method == 'GET':
+            return self.reply(200, server.ids)
+        if segments == ['items'] and method == 'POST':
+            return self.reply(200, json.loads(body or 'null'))
+        if len(segments) == 2 and segments[0] == 'items':
+            if method == 'GET' and server.stalls():
+                time.sleep(server.stall)
+            return self.reply(200, server.item(segments[1]))
+        if segments == ['big']:
+            return self.reply(200, server.big)
+        return self.reply(404, {'message': 'Got an invalid (or empty) URL'})
+
+    def check_signature(self, method, body):
+        timestamp = self.headers.get('X-Ovh-Timestamp')
+        signature = self.headers.get('X-Ovh-Signature')
+        if timestamp is None or signature is None:
+            return {'message': 'You must login first',
+                    'errorCode': 'NOT_AUTHENTICATED'}
+        if abs(int(timestamp) - (time.time() + DRIFT)) > 5:
+            return {'message': 'Query out of time',
+                    'errorCode': 'QUERY_TIME_OUT'}
+        url = 'http://%s%s' % (self.headers.get('Host'), self.path)
+        expected = '$1$' + hashlib.sha1('+'.join([
+            APP_SECRET, self.headers.get('X-Ovh-Consumer', ''), method, url,
+            body, timestamp])).hexdigest()
+        if signature != expected:
+            return {'message': 'Invalid signature',
+                    'errorCode': 'INVALID_SIGNATURE'}
+        return None
+
+    def do_GET(self):
+        self.handle_method('GET')
+
+    def do_POST(self):
+        self.handle_method('POST')
+
+    def do_PUT(self):
+        self.handle_method('PUT')
+
+    def do_DELETE(self):
+        self.handle_method('DELETE')
+
+
+class MockAPI(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """A local OVH API, run in a background thread
+
+    latency is the delay (in seconds) of each signed request, list_size the
+    number of ids of /items and large_size the number of objects of /big.
+    When stall_every is set, one GET /items/{id} out of stall_every is
+    answered stall seconds late, as a slow backend would.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+    # concurrent clients open many connections at once
+    request_queue_size = 128
+    prefix = '/1.0'
+
+    def __init__(self, latency=0, list_size=100, large_size=10000,
+                 stall=0, stall_every=0, address=('127.0.0.1', 0)):
+        BaseHTTPServer.HTTPServer.__init__(self, address, Handler)
+        self.latency = latency
+        self.stall = stall
+        self.stall_every = stall_every
+        self.items_served = 0
+        self.counts = {}
+        self.lock = threading.Lock()
+        self.me = {'nichandle': 'ab1234-ovh', 'city': 'Roubaix',
+                   'name': 'Le Stang', 'email': 'ps@lestang.fr'}
+        self.ids = ['item%d' % i for i in range(list_size)]
+        self.big = [self.item('big%d' % i) for i in range(large_size)]
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return 'http://%s:%d%s' % (self.server_address[0],
+                                   self.server_address[1], self.prefix)
+
+    def item(self, id):
+        return {'id': id, 'description': 'item %s' % id, 'state': 'ok',
+                'ips': ['192.0.2.%d' % (i + 1) for i in range(4)]}
+
+    # Tell if the item being served is one of the stalled ones
+    def stalls(self):
+        if not self.stall or not self.stall_every:
+            return False
+        with self.lock:
+            self.items_served += 1
+            return self.items_served % self.stall_every == 0
+
+    def count(self, method, path):
+        with self.lock:
+            key = '%s %s' % (method, path)
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    # Total number of requests received, or only the ones of path
+    def requests(self, path=None):
+        with self.lock:
+            if path is None:
+                return sum(self.counts.values())
+            return sum(count for key, count in self.counts.items()
+                       if key.split(' ', 1)[1] == path)
+
+    def reset(self):
+        with self.lock:
+            self.counts = {}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def _serve(queue, kwargs):
+    server = MockAPI(**kwargs)
+    queue.put(server.base_url)
+    server.serve_forever()
+
+
+class MockAPIProcess(object):
+    """A MockAPI run in a child process, so it does not compete with the
+    benchmarked client for the interpreter lock"""
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.process = None
+        self.base_url = None
+
+    def start(self):
+        queue = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=_serve,
+                                               args=(queue, self.kwargs))
+        self.process.daemon = True
+        self.process.start()
+        self.base_url = queue.get(timeout=30)
+        return self
+
+    def requests(self, path=None):
+        counts = requests.get('%s/_counts' % self.base_url).json()
+        return sum(count for key, count in counts.items()
+                   if path is None or key.split(' ', 1)[1] == path)
+
+    def reset(self):
+        requests.delete('%s/_counts' % self.base_url)
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join()
+
+
+if __name__ == '__main__':
+    server = MockAPI(latency=0.01)
+    print 'Mock API listening on %s' % server.base_url
+    server.serve_forever()
+
+# vim:set shiftwidth=4 tabstop=4 softtabstop=4 encoding=utf-8 expandtab textwidth=79
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Pierre-Samuel Le Stang (ps@lestang.fr)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+OCAPy tests, run with::
+
+    python setup.py test
+
+The tests needing HTTP run against the local mock API of the benchmarks.
+"""
+
+import os
+import sys
+import unittest
+
+# the mock API is not part of the package
+BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'benchmarks')
+if BENCHMARKS not in sys.path:
+    sys.path.insert(0, BENCHMARKS)
+
+from mockapi import MockAPI, APP_KEY, APP_SECRET, CONSUMER_KEY
+
+from OCAPy import OCAPy
+
+
+class MockAPITestCase(unittest.TestCase):
+    """Starts a MockAPI for the tests of the class, self.api is an OCAPy
+    instance using it"""
+
+    # options of the MockAPI
+    server_options = {}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockAPI(**cls.server_options).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.api = OCAPy(base_url=self.server.base_url, app_key=APP_KEY,
+                         app_secret=APP_SECRET, consumer_key=CONSUMER_KEY)
+        self.server.reset()
+
+    def tearDown(self):
+        self.api.sessions.close()
+
+# vim:set shiftwidth=4 tabstop=4 softtabstop=4 encoding=utf-8 expandtab textwidth=79
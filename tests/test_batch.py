@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Pierre-Samuel Le Stang (ps@lestang.fr)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import random
+import time
+import unittest
+
+from OCAPy.batch import Batch, Operation, _parents, _run, _waits
+from OCAPy.errors import OCAPyRequestException
+
+from tests import MockAPITestCase
+
+
+class Recorder(object):
+    """A resource recording the writes it receives, in the order they are
+    done, to a shared list. The writes of the paths of failing fail."""
+
+    def __init__(self, path, writes, failing=()):
+        self.path = path
+        self.writes = writes
+        self.failing = failing
+
+    def put(self, data=None):
+        # let the concurrent writes overtake each other
+        time.sleep(random.uniform(0, 0.002))
+        if self.path in self.failing:
+            raise RuntimeError('%s failed' % self.path)
+        self.writes.append((self.path, data))
+        return data
+
+
+def operations(*writes):
+    return [Operation(Recorder(path, []), 'PUT', {}, phase=phase)
+            for path, phase in writes]
+
+
+class WaitsTest(unittest.TestCase):
+
+    def test_parents(self):
+        self.assertEqual(_parents('/a/b/c'), ['/a/b', '/a'])
+        self.assertEqual(_parents('/a'), [])
+
+    def test_same_path(self):
+        self.assertEqual(_waits(operations(('/a', 0), ('/b', 0), ('/a', 0),
+                                           ('/a', 0))),
+                         [set(), set(), set([0]), set([2])])
+
+    # a write waits for the previous ones on its parents and sub paths
+    def test_overlapping_paths(self):
+        self.assertEqual(_waits(operations(('/a', 0), ('/a/b', 0),
+                                           ('/c', 0), ('/a', 0),
+                                           ('/a/b/c', 0))),
+                         [set(), set([0]), set(), set([0, 1]), set([1, 3])])
+
+    def test_phases(self):
+        self.assertEqual(_waits(operations(('/a', 0), ('/b', 0), ('/c', 1),
+                                           ('/c', 1), ('/d', 2))),
+                         [set(), set(), set([0, 1]), set([0, 1, 2]),
+                          set([2, 3])])
+
+
+class RunTest(unittest.TestCase):
+
+    def run_writes(self, writes, failing=(), max_workers=10):
+        done = []
+        batch = Batch(max_workers=max_workers)
+        for path, data in writes:
+            if path is None:
+                batch.barrier()
+            else:
+                batch.put(Recorder(path, done, failing), data=data)
+        return batch.run(), done
+
+    def assertPathOrder(self, done, writes):
+        self.assertEqual(sorted(done), sorted(writes))
+        for path in set(path for path, data in writes):
+            self.assertEqual([data for p, data in done if p == path],
+                             [data for p, data in writes if p == path])
+
+    # the writes of a path are done in the order they were queued
+    def test_path_order(self):
+        writes = [('/%s' % random.choice('abc'), index)
+                  for index in range(200)]
+        report, done = self.run_writes(writes)
+        self.assertTrue(report.ok)
+        self.assertPathOrder(done, writes)
+
+    def test_barrier(self):
+        report, done = self.run_writes([('/a', 0), ('/b', 1), (None, None),
+                                        ('/c', 2), ('/d', 3)])
+        self.assertTrue(report.ok)
+        self.assertEqual(set(done[:2]), set([('/a', 0), ('/b', 1)]))
+        self.assertEqual(set(done[2:]), set([('/c', 2), ('/d', 3)]))
+
+    # the writes waiting for a failed one are not done, the others are
+    def test_skip_after_failure(self):
+        report, done = self.run_writes([('/err', 0), ('/err/a', 1),
+                                        ('/ok', 2), ('/err', 3),
+                                        ('/err/a/b', 4), ('/ok', 5)],
+                                       failing=['/err'])
+        self.assertEqual(done, [('/ok', 2), ('/ok', 5)])
+        self.assertEqual([result.key.kwargs['data']
+                          for result in report.failed], [0, 1, 3, 4])
+        self.assertIsInstance(report.results[0].error, RuntimeError)
+        for result in report.results[1], report.results[3], \
+                      report.results[4]:
+            self.assertIn('not run: PUT /err failed', str(result.error))
+
+    def test_barrier_after_failure(self):
+        report, done = self.run_writes([('/err', 0), (None, None),
+                                        ('/ok', 1)], failing=['/err'])
+        self.assertEqual(done, [])
+        self.assertEqual(len(report.failed), 2)
+
+    def test_single_worker(self):
+        writes = [('/%s' % random.choice('ab'), index) for index in range(20)]
+        report, done = self.run_writes(writes, max_workers=1)
+        self.assertTrue(report.ok)
+        self.assertPathOrder(done, writes)
+
+    def test_empty(self):
+        self.assertEqual(_run([], [], 10), [])
+
+
+class BatchTest(MockAPITestCase):
+
+    def test_requests(self):
+        with Batch() as batch:
+            batch.put(self.api.items('a'), data={'description': 'a'})
+            batch.put(self.api.missing('x'), data={})
+            batch.delete(self.api.missing('x').sub)
+            batch.post(self.api.items, data={'description': 'b'})
+        report = batch.report
+        self.assertEqual([result.key.path for result in report.succeeded],
+                         ['/items/a', '/items'])
+        self.assertEqual(report.succeeded[1].value, {'description': 'b'})
+        self.assertIsInstance(report.failed[0].error, OCAPyRequestException)
+        self.assertIn('not run', str(report.failed[1].error))
+        self.assertEqual(self.server.requests('/missing/x'), 1)
+        self.assertEqual(self.server.requests('/missing/x/sub'), 0)
+
+        retried = report.retry()
+        self.assertEqual(len(retried.failed), 2)
+        self.assertEqual(self.server.requests('/missing/x'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim:set shiftwidth=4 tabstop=4 softtabstop=4 encoding=utf-8 expandtab textwidth=79
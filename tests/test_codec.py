@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Pierre-Samuel Le Stang (ps@lestang.fr)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import unittest
+
+from OCAPy.codec import ArrayParser, JSONView
+
+DOCUMENT = json.dumps([
+    1, -12.5e3, 123456, True, None, u'Roubaix', u'caf\xe9 €',
+    'a "quoted", [bracketed] string\\',
+    {'id': 'ns1', 'ips': ['192.0.2.1', '192.0.2.2'], 'nested': {'a': []}},
+    [], [[1, 2], {}], 42,
+], ensure_ascii=False, indent=1).encode('utf-8')
+
+
+def parse(chunks):
+    parser = ArrayParser()
+    elements = []
+    for chunk in chunks:
+        elements.extend(parser.feed(chunk))
+    elements.extend(parser.close())
+    return elements
+
+
+class ArrayParserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.expected = json.loads(DOCUMENT)
+
+    def test_whole(self):
+        self.assertEqual(parse([DOCUMENT]), self.expected)
+
+    # the document split at each position, multi bytes characters included
+    def test_chunk_boundaries(self):
+        for position in range(len(DOCUMENT) + 1):
+            self.assertEqual(parse([DOCUMENT[:position],
+                                    DOCUMENT[position:]]),
+                             self.expected, 'split at %d' % position)
+
+    def test_bytes(self):
+        self.assertEqual(parse(DOCUMENT), self.expected)
+
+    # elements are returned as soon as they are complete
+    def test_incremental(self):
+        parser = ArrayParser()
+        self.assertEqual(parser.feed('[{"a": 1}, {"b"'), [{'a': 1}])
+        self.assertEqual(parser.feed(': 2}, 3'), [{'b': 2}])
+        self.assertEqual(parser.feed(']'), [3])
+        self.assertEqual(parser.close(), [])
+
+    # a number is only complete once followed by a separator
+    def test_number_at_chunk_end(self):
+        self.assertEqual(parse(['[1, 12', '3, 4', '5]']), [1, 123, 45])
+
+    def test_unicode_chunks(self):
+        self.assertEqual(parse([u'["caf', u'\xe9"]']), [u'caf\xe9'])
+
+    def test_empty(self):
+        self.assertEqual(parse([' [', ' ] ']), [])
+
+    def test_truncated(self):
+        for document in ['', '[', '[1, 2', '[{"a": 1}', '["abc']:
+            self.assertRaises(ValueError, parse, [document])
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, parse, ['{"a": 1}'])
+        self.assertRaises(ValueError, parse, ['[1 2]'])
+        self.assertRaises(ValueError, parse, ['[1, }]'])
+
+
+class JSONViewTest(unittest.TestCase):
+
+    def test_array(self):
+        view = JSONView(DOCUMENT)
+        self.assertEqual(list(view), json.loads(DOCUMENT))
+        self.assertEqual(view[5], u'Roubaix')
+        self.assertRaises(IndexError, lambda: view[100])
+
+    def test_object(self):
+        view = JSONView('{"a": [1, 2]}')
+        self.assertEqual(view['a'], [1, 2])
+        self.assertEqual(len(view), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim:set shiftwidth=4 tabstop=4 softtabstop=4 encoding=utf-8 expandtab textwidth=79
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Pierre-Samuel Le Stang (ps@lestang.fr)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from OCAPy.crawl import Crawler
+from OCAPy.schema import SchemaStore
+
+from tests import MockAPITestCase
+
+LIST_SIZE = 30
+
+def path_parameters(*names):
+    return [{'name': name, 'paramType': 'path', 'required': True}
+            for name in names]
+
+OPERATIONS = {
+    '/me': {'GET': {'parameters': []}},
+    '/items': {'GET': {'parameters': [{'name': 'state', 'required': False,
+                                       'paramType': 'query'}]},
+               'POST': {'parameters': []}},
+    '/items/{id}': {'GET': {'parameters': path_parameters('id')}},
+    # not served by the mock API: an error record
+    '/missing': {'GET': {'parameters': []}},
+    # a required query parameter: not fetched
+    '/big': {'GET': {'parameters': [{'name': 'q', 'required': True,
+                                     'paramType': 'query'}]}},
+}
+
+EXPECTED = set(['/me', '/items', '/missing'] +
+               ['/items/item%d' % i for i in range(LIST_SIZE)])
+
+
+class Interrupted(Exception):
+    pass
+
+
+class CrawlerTest(MockAPITestCase):
+
+    server_options = {'list_size': LIST_SIZE}
+
+    def setUp(self):
+        MockAPITestCase.setUp(self)
+        self.directory = tempfile.mkdtemp()
+        self.store = SchemaStore(base_url=self.server.base_url,
+                                 directory=os.path.join(self.directory,
+                                                        'schemas'))
+        self.store.operations = OPERATIONS
+
+    def tearDown(self):
+        MockAPITestCase.tearDown(self)
+        shutil.rmtree(self.directory)
+
+    def crawler(self, name='crawl', **kwargs):
+        kwargs.setdefault('shard_size', 7)
+        kwargs.setdefault('checkpoint_every', 5)
+        kwargs.setdefault('max_workers', 4)
+        return Crawler(self.api, os.path.join(self.directory, name),
+                       store=self.store, **kwargs)
+
+    # Run a crawl failing at its count-th visit
+    def interrupt(self, crawler, count):
+        visit = crawler._visit
+        visits = []
+
+        def failing(segments):
+            visits.append(segments)
+            if len(visits) == count:
+                raise Interrupted()
+            return visit(segments)
+
+        crawler._visit = failing
+        self.assertRaises(Interrupted, crawler.run)
+
+    def assertRecords(self, crawler):
+        records = list(crawler.records())
+        paths = [record['path'] for record in records]
+        self.assertEqual(len(paths), len(set(paths)), 'duplicate records')
+        self.assertEqual(set(paths), EXPECTED)
+        return dict((record['path'], record) for record in records)
+
+    def test_crawl(self):
+        crawler = self.crawler()
+        report = crawler.run()
+        self.assertFalse(report.resumed)
+        self.assertEqual(report.records, len(EXPECTED))
+        self.assertEqual(report.errors, 1)
+        self.assertEqual(report.levels, 3)
+        self.assertEqual(report.shards, 5)
+        records = self.assertRecords(crawler)
+        self.assertEqual(records['/me']['value']['nichandle'], 'ab1234-ovh')
+        self.assertEqual(records['/items/item3']['template'], '/items/{id}')
+        self.assertIn('error', records['/missing'])
+        self.assertEqual(self.server.requests('/big'), 0)
+        # the work files are removed
+        self.assertEqual(sorted(name for name in os.listdir(crawler.directory)
+                                if not name.startswith('shard-')),
+                         ['checkpoint.json'])
+
+    # interrupted at any level, before or after a checkpoint, the resumed
+    # crawl writes each record once
+    def test_resume(self):
+        for count in range(1, len(EXPECTED) + 2, 3):
+            crawler = self.crawler('crawl-%d' % count)
+            self.interrupt(crawler, count)
+            with open(crawler.checkpoint_file) as f:
+                checkpointed = json.load(f)['records']
+            self.server.reset()
+            report = self.crawler('crawl-%d' % count).run()
+            self.assertTrue(report.resumed)
+            self.assertEqual(report.records, len(EXPECTED))
+            self.assertEqual(report.errors, 1)
+            self.assertRecords(crawler)
+            # what was checkpointed is not fetched again
+            self.assertEqual(self.server.requests() -
+                             self.server.requests('/auth/time'),
+                             len(EXPECTED) - checkpointed)
+
+    # a finished crawl is not run again
+    def test_finished(self):
+        self.crawler().run()
+        self.server.reset()
+        report = self.crawler().run()
+        self.assertTrue(report.resumed)
+        self.assertEqual(report.records, len(EXPECTED))
+        self.assertEqual(self.server.requests(), 0)
+
+    # what was written after the checkpoint is dropped
+    def test_truncate(self):
+        crawler = self.crawler()
+        self.interrupt(crawler, 20)
+        with open(crawler.checkpoint_file) as f:
+            state = json.load(f)
+        shard = crawler.shard_file(state['shard'])
+        following = crawler.level_file(state['level'] + 1)
+        with open(shard, 'ab') as f:
+            f.write('{"path": "/partial"')
+        with open(following, 'ab') as f:
+            f.write('[["items", false], ["item')
+        open(crawler.shard_file(state['shard'] + 1), 'wb').close()
+
+        crawler._truncate(state)
+        self.assertEqual(os.path.getsize(shard), state['shard_bytes'])
+        self.assertEqual(os.path.getsize(following), state['next'])
+        self.assertFalse(os.path.exists(
+            crawler.shard_file(state['shard'] + 1)))
+
+    def test_prefixes(self):
+        crawler = self.crawler(prefixes=['/items/'])
+        report = crawler.run()
+        self.assertEqual(report.records, LIST_SIZE + 1)
+        self.assertEqual(self.server.requests('/me'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim:set shiftwidth=4 tabstop=4 softtabstop=4 encoding=utf-8 expandtab textwidth=79
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2013 Pierre-Samuel Le Stang (ps@lestang.fr)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+import unittest
+
+from OCAPy.errors import OCAPyTimeoutException
+from OCAPy.flight import SingleFlight
+
+FOLLOWERS = 5
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    # A call lasting until release is set
+    def call(self, value=None, error=None):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(10)
+        if error is not None:
+            raise error
+        return value
+
+    # Run the call of key in a leader and FOLLOWERS threads, release it once
+    # they all wait for it, return the outcome of each thread
+    def run_flight(self, key, **kwargs):
+        outcomes = []
+        lock = threading.Lock()
+
+        def do():
+            try:
+                outcome = self.flight.do(key, lambda: self.call(**kwargs))
+            except Exception as e:
+                outcome = e
+            with lock:
+                outcomes.append(outcome)
+
+        threads = [threading.Thread(target=do)]
+        threads[0].start()
+        self.assertTrue(self.started.wait(10))
+        for i in range(FOLLOWERS):
+            threads.append(threading.Thread(target=do))
+            threads[-1].start()
+        while self.flight.flights[key].waiters < FOLLOWERS:
+            time.sleep(0.001)
+        self.release.set()
+        for thread in threads:
+            thread.join(10)
+        return outcomes
+
+    def test_value_shared(self):
+        outcomes = self.run_flight('me', value={'nichandle': 'ab1234-ovh'})
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(sorted(shared for value, shared in outcomes),
+                         [False] + [True] * FOLLOWERS)
+        for value, shared in outcomes:
+            self.assertEqual(value, {'nichandle': 'ab1234-ovh'})
+
+    # the followers raise the exception of the leader
+    def test_error_shared(self):
+        error = ValueError('boom')
+        outcomes = self.run_flight('me', error=error)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(len(outcomes), FOLLOWERS + 1)
+        for outcome in outcomes:
+            self.assertIs(outcome, error)
+
+    # nothing is kept once the call is done, failed or not
+    def test_not_kept(self):
+        self.run_flight('me', error=ValueError('boom'))
+        self.assertEqual(len(self.flight), 0)
+        self.assertEqual(self.flight.do('me', lambda: 1), (1, False))
+        self.assertEqual(self.flight.do('me', lambda: 2), (2, False))
+
+    def test_keys(self):
+        self.started.set()
+        self.release.set()
+        self.assertEqual(self.flight.do('a', lambda: 'a'), ('a', False))
+        self.assertEqual(self.flight.do('b', lambda: 'b'), ('b', False))
+
+    def test_follower_timeout(self):
+        leader = threading.Thread(target=self.flight.do,
+                                  args=('me', self.call))
+        leader.start()
+        self.assertTrue(self.started.wait(10))
+        try:
+            self.assertRaises(OCAPyTimeoutException, self.flight.do, 'me',
+                              lambda: None, timeout=0.01)
+        finally:
+            self.release.set()
+            leader.join(10)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim:set shiftwidth=4 tabstop=4 softtabstop=4 encoding=utf-8 expandtab textwidth=79